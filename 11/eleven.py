@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import re
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 import math
+import time
 from typing import Callable, Optional
 
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 
 @dataclass
 class Op:
@@ -21,13 +30,71 @@ class Op:
     assert self.op == "+"
     return val + self.rhs
 
+  @classmethod
+  def from_expression(cls, expression: str) -> Optional["Op"]:
+    """Parses `old * old`, `old * N` or `old + N`, or returns None for anything else."""
+    tokens = expression.split()
+    if len(tokens) != 3:
+      return None
+    lhs, op, rhs = tokens
+    if lhs != "old" or op not in ("*", "+"):
+      return None
+    if rhs == "old":
+      return Op(op="sq") if op == "*" else None
+    if not rhs.isdigit():
+      return None
+    return Op(op=op, rhs=int(rhs))
+
+
+# Tokens allowed in an operation.
+operation_token_pattern = re.compile(r"\s*(old|\d+|[+*])")
+
+
+def compile_operation(expression: str) -> Callable[[int], int]:
+  """
+  Compiles an operation like `old * old + 3` into a function of `old`. Only
+  `old`, integers, `+` and `*` are allowed, with the usual precedence.
+  """
+  tokens = []
+  pos = 0
+  while pos < len(expression.rstrip()):
+    match = operation_token_pattern.match(expression, pos)
+    assert match is not None, f"bad operation: {expression}"
+    tokens.append(match.group(1))
+    pos = match.end()
+  # Operands and operators must alternate.
+  for i, token in enumerate(tokens):
+    is_operator = token in "+*"
+    assert is_operator == (i % 2 == 1), f"bad operation: {expression}"
+  assert len(tokens) % 2 == 1, f"bad operation: {expression}"
+
+  return eval(f"lambda old: {' '.join(tokens)}", {"__builtins__": {}})
+
+
+def operation_table(operation: Callable[[int], int], max_mod: int) -> Callable[[int], int]:
+  """
+  Precomputes an operation for every worry level mod max_mod. The returned
+  function only accepts worry levels below max_mod, and its results are
+  already reduced mod max_mod.
+  """
+  table = array("q", (operation(old) % max_mod for old in range(max_mod)))
+  return table.__getitem__
+
+
+# How to run each monkey's operation.
+OPERATION_KINDS = ("dispatch", "compiled", "table")
+# Largest max_mod worth building operation tables for.
+TABLE_LIMIT = 1 << 20
+
 
 @dataclass
 class Monkey:
   throws: int = 0
   # Items; value is worry level.
   items: list[int] = field(default_factory=list)
-  operation: Optional[Op] = None
+  # Operation as written, and as something to call.
+  expression: str = ""
+  operation: Optional[Callable[[int], int]] = None
   divisible_by: int = 0
   true_target: int = -1
   false_target: int = -1
@@ -39,7 +106,7 @@ class Monkey:
     """
     for item in self.items:
       # Do operation.
-      item = self.operation.apply(item)
+      item = self.operation(item)
 
       # Decrease worry by 1/3rd.
       # TODO: This is only part 2.
@@ -60,14 +127,137 @@ class Monkey:
     self.items.clear()
 
 
-def main():
+def item_throws(
+  monkeys: list[Monkey], monkey_i: int, item: int, rounds: int, detect_cycles: bool = True
+) -> list[int]:
+  """
+  Follows a single item held by monkey `monkey_i` for the given number of
+  rounds, returning how many times each monkey throws it.
+
+  An item's path only depends on which monkey holds it and its worry level
+  mod max_mod, so once that state repeats at the start of a round, the rest
+  of the rounds are whole cycles plus a partial one. With `detect_cycles`
+  off, every round is played out.
+  """
+  max_mod = monkeys[0].max_mod
+  throws = [0] * len(monkeys)
+  item = item % max_mod
+  # Round each start-of-round state was first seen in.
+  seen: dict[tuple[int, int], int] = {}
+  # Monkeys that threw the item, per round.
+  round_throwers: list[list[int]] = []
+  for round_num in range(rounds):
+    if detect_cycles:
+      state = (monkey_i, item)
+      if state in seen:
+        cycle_start = seen[state]
+        cycle_len = round_num - cycle_start
+        full_cycles, extra_rounds = divmod(rounds - round_num, cycle_len)
+        for i in range(cycle_start, cycle_start + cycle_len):
+          for thrower in round_throwers[i]:
+            throws[thrower] += full_cycles
+            if i < cycle_start + extra_rounds:
+              throws[thrower] += 1
+        return throws
+      seen[state] = round_num
+
+    # Monkeys go in order, so the item keeps moving this round as long as it's
+    # thrown to a later monkey.
+    throwers = []
+    while True:
+      monkey = monkeys[monkey_i]
+      item = monkey.operation(item) % max_mod
+      if item % monkey.divisible_by == 0:
+        target = monkey.true_target
+      else:
+        target = monkey.false_target
+      assert target != monkey_i, f"monkey {monkey_i} throws to itself"
+      throwers.append(monkey_i)
+      throws[monkey_i] += 1
+      is_next_round = target < monkey_i
+      monkey_i = target
+      if is_next_round:
+        break
+    if detect_cycles:
+      round_throwers.append(throwers)
+
+  return throws
+
+
+# Monkeys for pool workers, set once per worker by init_worker.
+worker_monkeys: list[Monkey] = []
+
+
+def init_worker(monkeys: list[Monkey], operation_kind: str) -> None:
+  global worker_monkeys
+  worker_monkeys = monkeys
+  compile_operations(worker_monkeys, operation_kind)
+
+
+def items_throws(items: list[tuple[int, int]], rounds: int, detect_cycles: bool) -> list[int]:
+  """
+  Pool task: follows each (monkey index, worry) item independently, returning
+  total throws per monkey.
+  """
+  throws = [0] * len(worker_monkeys)
+  for monkey_i, item in items:
+    for thrower, count in enumerate(
+      item_throws(worker_monkeys, monkey_i, item, rounds, detect_cycles)
+    ):
+      throws[thrower] += count
+  return throws
+
+
+def parallel_throws(
+  monkeys: list[Monkey], rounds: int, detect_cycles: bool, workers: int, operation_kind: str
+) -> list[int]:
+  """
+  Splits all held items across a process pool and sums up the per-monkey
+  throws each worker comes back with.
+  """
+  items = [
+    (monkey_i, item) for monkey_i, monkey in enumerate(monkeys) for item in monkey.items
+  ]
+  # A few chunks per worker, so a slow chunk doesn't hold up the rest.
+  chunk_count = min(len(items), workers * 4) or 1
+  chunks = [items[i::chunk_count] for i in range(chunk_count)]
+  throws = [0] * len(monkeys)
+  # Compiled operations don't pickle, so workers compile their own.
+  bare_monkeys = [replace(monkey, operation=None) for monkey in monkeys]
+  with ProcessPoolExecutor(
+    workers, initializer=init_worker, initargs=(bare_monkeys, operation_kind)
+  ) as pool:
+    futures = [pool.submit(items_throws, chunk, rounds, detect_cycles) for chunk in chunks]
+    for future in futures:
+      for thrower, count in enumerate(future.result()):
+        throws[thrower] += count
+  return throws
+
+
+def compile_operations(monkeys: list[Monkey], operation_kind: str) -> None:
+  """
+  Sets each monkey's operation from its expression. Tables are only built if
+  max_mod is small enough, and dispatch only if Op can handle the
+  expression; otherwise the compiled operation is used.
+  """
+  for monkey in monkeys:
+    op = Op.from_expression(monkey.expression) if operation_kind == "dispatch" else None
+    if op is not None:
+      monkey.operation = op.apply
+    else:
+      monkey.operation = compile_operation(monkey.expression)
+      if operation_kind == "table" and monkey.max_mod <= TABLE_LIMIT:
+        monkey.operation = operation_table(monkey.operation, monkey.max_mod)
+
+
+def read_monkeys(filename: str, operation_kind: str = "compiled") -> list[Monkey]:
   monkeys = []
   monkey_pattern = re.compile(r"Monkey \d+:")
   items_pattern = re.compile(r"Starting items: (.*)$")
-  operation_pattern = re.compile(r"Operation: new = ([^ ]+) (.) ([^ ]+)$")
+  operation_pattern = re.compile(r"Operation: new = (.+)$")
   test_pattern = re.compile(r"Test: divisible by (\d+)$")
   throw_pattern = re.compile(r"If (true|false): throw to monkey (\d+)$")
-  with open("input.txt", "r") as infile:
+  with open(filename, "r") as infile:
     has_more = True
     while has_more:
       monkey = Monkey()
@@ -87,18 +277,7 @@ def main():
       line = infile.readline()
       match = operation_pattern.search(line)
       assert match is not None, f"bad operation line: {line}"
-      lhs, op, rhs = match.group(1, 2, 3)
-      assert lhs == "old", f"can't handle {line}"
-      if rhs == "old\n":
-        assert op == "*"
-        monkey.operation = Op(op="sq")
-      else:
-        rhs = int(rhs)
-        if op == "*":
-          monkey.operation = Op(op=op, rhs=rhs)
-        else:
-          assert op == "+", f"bad op on: {line}"
-          monkey.operation = Op(op=op, rhs=rhs)
+      monkey.expression = match.group(1).strip()
 
       # Test.
       line = infile.readline()
@@ -130,13 +309,135 @@ def main():
     max_mod = max_mod * mon.divisible_by
   for mon in monkeys:
     mon.max_mod = max_mod
-
-  # Iterate 20 rounds.
-  for i in range(0, 10000):
+    # Only worry mod max_mod matters, and operation tables need it reduced.
+    mon.items = [item % max_mod for item in mon.items]
+
+  compile_operations(monkeys, operation_kind)
+
+  return monkeys
+
+
+def numpy_throws(monkeys: list[Monkey], rounds: int) -> list[int]:
+  """
+  Plays the given rounds with every worry level in one int64 array, reduced
+  mod max_mod, next to an array of which monkey holds each item. Each turn
+  applies the monkey's operation and test to all of its items at once.
+  """
+  assert np is not None, "the numpy engine needs numpy installed"
+  max_mod = monkeys[0].max_mod
+  operations = [compile_operation(monkey.expression) for monkey in monkeys]
+  for monkey, operation in zip(monkeys, operations):
+    # Operations only add and multiply, so the largest residue gives the
+    # largest result.
+    assert operation(max_mod - 1) < 2**63, f"{monkey.expression} overflows int64"
+
+  worries = np.array([item for monkey in monkeys for item in monkey.items], dtype=np.int64)
+  owners = np.array(
+    [monkey_i for monkey_i, monkey in enumerate(monkeys) for _ in monkey.items],
+    dtype=np.int16,
+  )
+  throws = [0] * len(monkeys)
+  for _ in range(rounds):
+    for monkey_i, (monkey, operation) in enumerate(zip(monkeys, operations)):
+      held = np.flatnonzero(owners == monkey_i)
+      if held.size == 0:
+        continue
+      items = operation(worries[held]) % max_mod
+      worries[held] = items
+      owners[held] = np.where(
+        items % monkey.divisible_by == 0, monkey.true_target, monkey.false_target
+      )
+      throws[monkey_i] += held.size
+  return throws
+
+
+def play_rounds(monkeys: list[Monkey], rounds: int) -> None:
+  for i in range(0, rounds):
     for monkey in monkeys:
       monkey.take_turn(monkeys)
 
 
+def benchmark_operations(filename: str, rounds: int, repeats: int = 5) -> None:
+  """
+  Times the round-by-round loop with each kind of operation, taking the best
+  of `repeats` runs after an untimed warmup.
+  """
+  baseline = None
+  for operation_kind in OPERATION_KINDS:
+    elapsed = math.inf
+    for run in range(repeats + 1):
+      monkeys = read_monkeys(filename, operation_kind)
+      start = time.perf_counter()
+      play_rounds(monkeys, rounds)
+      if run > 0:
+        elapsed = min(elapsed, time.perf_counter() - start)
+    baseline = baseline or elapsed
+    throws = [monkey.throws for monkey in monkeys]
+    print(f"{operation_kind:>8}: {elapsed:.3f}s ({baseline / elapsed:.2f}x); throws = {throws}")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--input", default="input.txt", help="monkey notes to read")
+  parser.add_argument("--rounds", type=int, default=10000, help="rounds to play")
+  parser.add_argument(
+    "--cycles",
+    action="store_true",
+    help="follow each item alone and skip ahead once its path repeats",
+  )
+  parser.add_argument(
+    "--operations",
+    choices=OPERATION_KINDS,
+    default="dispatch",
+    help=(
+      "how to run each monkey's operation; any mix of old, integers, + and * that dispatch can't "
+      "handle is compiled"
+    ),
+  )
+  parser.add_argument(
+    "--bench",
+    action="store_true",
+    help="time each kind of operation over the given rounds, then exit",
+  )
+  parser.add_argument(
+    "--numpy", action="store_true", help="play rounds on numpy arrays of items"
+  )
+  parser.add_argument(
+    "--workers",
+    type=int,
+    default=0,
+    help="follow items independently across this many processes",
+  )
+  args = parser.parse_args()
+  if args.numpy and args.workers > 0:
+    parser.error("--numpy plays every item in one process; it can't be combined with --workers")
+  if args.numpy and args.cycles:
+    parser.error("--numpy plays rounds out; it can't be combined with --cycles")
+
+  if args.bench:
+    benchmark_operations(args.input, args.rounds)
+    return
+
+  monkeys = read_monkeys(args.input, args.operations)
+
+  if args.workers > 0 or args.numpy:
+    if args.numpy:
+      throws = numpy_throws(monkeys, args.rounds)
+    else:
+      throws = parallel_throws(monkeys, args.rounds, args.cycles, args.workers, args.operations)
+    for monkey, count in zip(monkeys, throws):
+      monkey.throws = count
+      monkey.items.clear()
+  elif args.cycles:
+    for monkey_i, monkey in enumerate(monkeys):
+      for item in monkey.items:
+        for thrower, count in enumerate(item_throws(monkeys, monkey_i, item, args.rounds)):
+          monkeys[thrower].throws += count
+      monkey.items.clear()
+  else:
+    play_rounds(monkeys, args.rounds)
+
+
   # Find top-two monkeys.
   sorted_mons = sorted(monkeys, key=lambda mon: mon.throws)
   top_two = sorted_mons[-2:]
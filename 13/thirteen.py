@@ -1,49 +1,152 @@
 #!/usr/bin/env python3
 
+import argparse
+from array import array
+import mmap
+import random
 import re
+import sys
+import time
 from dataclasses import dataclass, field
 import math
-from typing import Callable, Optional
+from typing import Callable, Iterable, Iterator, Union
 from functools import cmp_to_key
 
 
-def check_order(first, second) -> Optional[bool]:
-  if type(first) != type(second):
-    if type(first) == list:
-      assert type(second) == int
-      second = [second]
-    else:
-      assert type(first) == int
-      first = [first]
+# Tokens in a packet file. Anything that isn't a bracket, number, comma,
+# newline or other whitespace lands in the last group.
+packet_token_pattern = re.compile(rb"(\[)|(\])|(\d+)|(,)|(\n)|[^\S\n]+|(.)")
 
-  if type(first) == int:
-    if first < second:    
-      return True
-    elif first > second:
-      return False
-    else:
-      return None
+# Flat encoding of brackets; numbers are stored as themselves, so they have
+# to fit in an int64 alongside them.
+FLAT_OPEN = -1
+FLAT_CLOSE = -2
+FLAT_MAX = 2**63 - 1
 
-  assert type(first) == list and type(second) == list
 
-  # Check each element. Must be list.
-  for i in range(0, len(first)):
-    if i >= len(second):
-      return False
+def parse_packets(data: Union[bytes, mmap.mmap], flat: bool = False) -> Iterator[Union[list, array]]:
+  """
+  Parses every packet out of a buffer in one pass, yielding them in order.
+  Packets are nested lists, or with `flat` an array of numbers with
+  FLAT_OPEN and FLAT_CLOSE standing in for brackets. Each packet has to sit
+  on a line of its own.
+  """
+  # Lists being built, innermost last. Flat packets only need the depth.
+  stack: list[list] = []
+  depth = 0
+  tokens = array("q")
+  # Inside a packet: whether the last token was [, a comma, or an item.
+  # Outside: whether a packet already ended on this line.
+  after = "item"
+  line_done = False
+  for match in packet_token_pattern.finditer(data):
+    open_bracket, close_bracket, number, comma, newline, bad = match.groups()
+    where = f"at byte {match.start()}"
+    if bad is not None:
+      assert False, f"bad character {bad!r} {where}"
+    elif newline is not None:
+      assert depth == 0, f"packet split across lines {where}"
+      line_done = False
+    elif comma is not None:
+      assert depth > 0 and after == "item", f"unexpected comma {where}"
+      after = "comma"
+    elif open_bracket is not None:
+      if depth == 0:
+        assert not line_done, f"second packet on one line {where}"
+      else:
+        assert after != "item", f"missing comma before [ {where}"
+      depth += 1
+      after = "["
+      if flat:
+        tokens.append(FLAT_OPEN)
+      else:
+        stack.append([])
+    elif close_bracket is not None:
+      assert depth > 0, f"unmatched ] {where}"
+      assert after != "comma", f"trailing comma {where}"
+      depth -= 1
+      after = "item"
+      if flat:
+        tokens.append(FLAT_CLOSE)
+      else:
+        packet = stack.pop()
+        if stack:
+          stack[-1].append(packet)
+      if depth == 0:
+        line_done = True
+        if flat:
+          yield tokens
+          tokens = array("q")
+        else:
+          yield packet
+    elif number is not None:
+      assert depth > 0, f"number outside a packet {where}"
+      assert after != "item", f"missing comma before {number.decode()} {where}"
+      after = "item"
+      if flat:
+        assert int(number) <= FLAT_MAX, f"{number.decode()} is too big for a flat packet {where}"
+        tokens.append(int(number))
+      else:
+        stack[-1].append(int(number))
+  assert depth == 0, "unterminated packet at end of input"
 
-    answer = check_order(first[i], second[i])
-    if answer is not None:
-      return answer
 
-  # Exhausted first list. Check length.
-  if len(first) == len(second):
-    # Equal!
-    return None
-  else:
-    # In order! First is shorter.
-    return True
+def read_packets(filename: str, flat: bool = False) -> Iterator[Union[list, array]]:
+  """Memory-maps a packet file and parses packets out of it."""
+  with open(filename, "rb") as infile:
+    with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      yield from parse_packets(data, flat)
+
 
 def sort_order(first, second) -> int:
+  """
+  Returns -1, 0 or 1 as `first` sorts before, the same as, or after
+  `second`.
+
+  Both packets are walked together with an explicit stack, so deep nesting
+  can't hit the recursion limit. An int compared with a list stands in for
+  a one-element list of itself, so no wrapper lists are built.
+  """
+  if type(first) == int and type(second) == int:
+    return (first > second) - (first < second)
+
+  # Lists (or ints standing in for lists) being compared, their lengths, and
+  # the index of the next element to compare. The index is shared, since the
+  # two sides move in lockstep.
+  first_len = len(first) if type(first) == list else 1
+  second_len = len(second) if type(second) == list else 1
+  i = 0
+  stack = []
+  while True:
+    if i == first_len or i == second_len:
+      if i < second_len:
+        # In order! First is shorter.
+        return -1
+      if i < first_len:
+        return 1
+      # Equal! Carry on with the enclosing lists.
+      if not stack:
+        return 0
+      first, first_len, second, second_len, i = stack.pop()
+      continue
+
+    first_item = first[i] if type(first) == list else first
+    second_item = second[i] if type(second) == list else second
+    i += 1
+    if type(first_item) == int and type(second_item) == int:
+      if first_item != second_item:
+        return -1 if first_item < second_item else 1
+      continue
+
+    stack.append((first, first_len, second, second_len, i))
+    first, second = first_item, second_item
+    first_len = len(first) if type(first) == list else 1
+    second_len = len(second) if type(second) == list else 1
+    i = 0
+
+
+def sort_order_recursive(first, second) -> int:
+  """The original recursive version of sort_order, kept for benchmarks."""
   if type(first) != type(second):
     if type(first) == list:
       assert type(second) == int
@@ -67,7 +170,7 @@ def sort_order(first, second) -> int:
     if i >= len(second):
       return 1
 
-    answer = sort_order(first[i], second[i])
+    answer = sort_order_recursive(first[i], second[i])
     if answer != 0:
       return answer
 
@@ -80,43 +183,241 @@ def sort_order(first, second) -> int:
     return -1
 
 
+def flatten_packet(packet: list) -> array:
+  """Converts a nested packet to the flat encoding used by parse_packets."""
+  tokens = array("q", [FLAT_OPEN])
+  # Iterators over the lists being walked, innermost last.
+  stack = [iter(packet)]
+  while stack:
+    item = next(stack[-1], None)
+    if item is None:
+      stack.pop()
+      tokens.append(FLAT_CLOSE)
+    elif type(item) == list:
+      tokens.append(FLAT_OPEN)
+      stack.append(iter(item))
+    else:
+      assert item <= FLAT_MAX, f"{item} is too big for a flat packet"
+      tokens.append(item)
+  return tokens
+
+
+def packet_depth(tokens: array) -> int:
+  """Returns the most lists open at once in a flat packet."""
+  depth = max_depth = 0
+  for token in tokens:
+    if token == FLAT_OPEN:
+      depth += 1
+      max_depth = max(depth, max_depth)
+    elif token == FLAT_CLOSE:
+      depth -= 1
+  return max_depth
+
+
+# Depth sort keys pad every int to. Keys all use it, so they compare across
+# batches, and deeper packets are sorted with the comparator instead.
+SORT_KEY_DEPTH = 8
+
+
+def packet_sort_key(tokens: array, depth: int = SORT_KEY_DEPTH) -> bytes:
+  """
+  Returns a byte string that orders the same way sort_order does, for flat
+  packets no deeper than `depth`. Keys are only comparable with other keys
+  built with the same depth.
+
+  Comparing an int to a list wraps the int, and wrapping never changes how an
+  int compares, so every int is wrapped until it sits `depth` lists deep.
+  Then ints only ever meet ints and lists only meet lists, and packets
+  compare like their token streams with closing brackets sorting lowest.
+  """
+  close_token, open_token, int_offset = 0, 1, 2
+  # Unsigned, so every flat number still fits after the offset.
+  key = array("Q")
+  open_count = 0
+  for token in tokens:
+    if token == FLAT_OPEN:
+      open_count += 1
+      key.append(open_token)
+    elif token == FLAT_CLOSE:
+      open_count -= 1
+      key.append(close_token)
+    else:
+      padding = depth - open_count
+      key.extend([open_token] * padding)
+      key.append(token + int_offset)
+      key.extend([close_token] * padding)
+  # Big-endian, so bytes compare like the tokens.
+  if sys.byteorder == "little":
+    key.byteswap()
+  return key.tobytes()
+
+
+def sort_packets(packets: list[list]) -> list[list]:
+  """
+  Sorts packets by packet_sort_key, or with sort_order if any are deeper than
+  SORT_KEY_DEPTH, since every key grows with the depth.
+  """
+  flat_packets = [flatten_packet(packet) for packet in packets]
+  if any(packet_depth(tokens) > SORT_KEY_DEPTH for tokens in flat_packets):
+    return sorted(packets, key=cmp_to_key(sort_order))
+  keys = [packet_sort_key(tokens) for tokens in flat_packets]
+  order = sorted(range(len(packets)), key=keys.__getitem__)
+  return [packets[i] for i in order]
+
+
+@dataclass
+class MarkerRanks:
+  """
+  Counts, for each marker packet, how many packets compare less than it,
+  without keeping the packets around.
+  """
+  markers: list[list]
+  less_counts: list[int] = field(default_factory=list)
+
+  def __post_init__(self):
+    self.less_counts = [0] * len(self.markers)
+
+  def add(self, packet: list) -> None:
+    for i, marker in enumerate(self.markers):
+      if sort_order(packet, marker) < 0:
+        self.less_counts[i] += 1
+
+  def ranks(self) -> list[int]:
+    """
+    Returns each marker's 0-based index if it were sorted in with the packets
+    and the other markers, ahead of anything it equals.
+    """
+    return [
+      less_count + sum(1 for other in self.markers if sort_order(other, marker) < 0)
+      for marker, less_count in zip(self.markers, self.less_counts)
+    ]
+
+
+def marker_ranks(packets: Iterable[list], markers: list[list]) -> list[int]:
+  """Ranks the markers against a stream of packets in one pass."""
+  marker_ranks = MarkerRanks(markers)
+  for packet in packets:
+    marker_ranks.add(packet)
+  return marker_ranks.ranks()
+
+
+def random_packet(rng: random.Random, max_depth: int = 4) -> list:
+  packet = []
+  for _ in range(rng.randint(0, 4)):
+    if max_depth > 1 and rng.random() < 0.4:
+      packet.append(random_packet(rng, max_depth - 1))
+    else:
+      packet.append(rng.randint(0, 10))
+  return packet
+
+
+def benchmark_sort(count: int) -> None:
+  """Sorts random packets with the comparator and with sort keys."""
+  rng = random.Random(0)
+  packets = [random_packet(rng) for _ in range(count)]
+
+  start = time.perf_counter()
+  by_comparator = sorted(packets, key=cmp_to_key(sort_order))
+  comparator_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  by_key = sort_packets(packets)
+  key_time = time.perf_counter() - start
+
+  assert all(a is b for a, b in zip(by_comparator, by_key)), "sorts disagree"
+  print(f"{count} packets: comparator {comparator_time:.2f}s, keys {key_time:.2f}s ({comparator_time / key_time:.1f}x)")
+
+
+def nested_packet(depth: int, value: int) -> list:
+  """Builds `value` wrapped in `depth` lists."""
+  packet = value
+  for _ in range(depth):
+    packet = [packet]
+  return packet
+
+
+def benchmark_compare(count: int) -> None:
+  """
+  Times sort_order against sort_order_recursive on pairs of random packets,
+  then checks sort_order on packets nested thousands of lists deep.
+  """
+  rng = random.Random(0)
+  pairs = [(random_packet(rng), random_packet(rng)) for _ in range(count)]
+  timings = []
+  for compare in (sort_order_recursive, sort_order):
+    start = time.perf_counter()
+    results = [compare(first, second) for first, second in pairs]
+    timings.append(time.perf_counter() - start)
+    if compare is sort_order_recursive:
+      expected = results
+    else:
+      assert results == expected, "comparators disagree"
+  print(
+    f"{count} pairs: recursive {timings[0]:.2f}s, iterative {timings[1]:.2f}s "
+    f"({timings[0] / timings[1]:.2f}x)"
+  )
+
+  depth = 10 * sys.getrecursionlimit()
+  assert sort_order(nested_packet(depth, 1), nested_packet(depth, 2)) == -1
+  assert sort_order(nested_packet(depth, 2), [2]) == 0
+  assert sort_order([nested_packet(depth, 2)], nested_packet(depth, [])) == 1
+  assert sort_order(nested_packet(depth, [1, 2]), nested_packet(depth - 1, [1])) == 1
+  try:
+    sort_order_recursive(nested_packet(depth, 1), nested_packet(depth, 2))
+    recursive_result = "ok"
+  except RecursionError:
+    recursive_result = "RecursionError"
+  print(f"{depth} deep: iterative ok, recursive {recursive_result}")
+
+
 def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    "--bench",
+    type=int,
+    metavar="COUNT",
+    help="compare comparator and key sorts on COUNT random packets, then exit",
+  )
+  parser.add_argument(
+    "--bench-compare",
+    type=int,
+    metavar="COUNT",
+    help="compare comparators on COUNT pairs of random packets, then exit",
+  )
+  args = parser.parse_args()
+
+  if args.bench:
+    benchmark_sort(args.bench)
+    return
+  if args.bench_compare:
+    benchmark_compare(args.bench_compare)
+    return
+
   pair_count = 0
   good_pairs = []
-  all_lines = []
-  with open("input.txt", "r") as infile:
-    has_more = True
-    while has_more:
-      pair_count += 1
-      first = eval(infile.readline())
-      second = eval(infile.readline())
-      assert type(first) == list
-      assert type(second) == list
-      all_lines.append(first)
-      all_lines.append(second)
-
-      # Blank line.
-      line = infile.readline()
-      has_more = line != ""
-
-      # Compare.
-      answer = check_order(first, second)
-      if answer is True:
-        good_pairs.append(pair_count)
-      elif answer is False:
-        pass
-      else:
-        print(f"Warning: Equal on line {pair_count}")
+  dividers = MarkerRanks([[[2]], [[6]]])
+  packets = read_packets("input.txt")
+  for first in packets:
+    pair_count += 1
+    second = next(packets, None)
+    assert second is not None, f"pair {pair_count} is missing its second packet"
+    dividers.add(first)
+    dividers.add(second)
+
+    # Compare.
+    answer = sort_order(first, second)
+    if answer < 0:
+      good_pairs.append(pair_count)
+    elif answer > 0:
+      pass
+    else:
+      print(f"Warning: Equal on line {pair_count}")
 
   total = sum(good_pairs)
 
   print(f"done: {pair_count}; total = {total}")
 
-  all_lines.append([[2]])
-  all_lines.append([[6]])
-  sorted_lines = sorted(all_lines, key=cmp_to_key(sort_order))
-  index_start = sorted_lines.index([[2]])
-  index_end = sorted_lines.index([[6]])
+  index_start, index_end = dividers.ranks()
 
   print(f"done sorted: ({index_start}, {index_end}); key = {(index_start + 1) * (index_end + 1)}")
 
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
+import argparse
 from collections import defaultdict
-from typing import Optional
+from dataclasses import dataclass
+import random
+import sys
+import time
+from typing import Callable, Optional, Union
 
 
 def do_one_sand(sparse_grid: dict[int, dict[int, str]], max_y: int) -> tuple[bool, bool]:
@@ -22,6 +27,29 @@ def do_one_sand(sparse_grid: dict[int, dict[int, str]], max_y: int) -> tuple[boo
   assert False, "reached end of function prematurely"
 
 
+def do_one_sand_path(sparse_grid: dict[int, dict[int, str]], max_y: int, path: list[tuple[int, int]]) -> tuple[bool, bool]:
+  """
+  Same as do_one_sand, but starts from the end of the previous grain's path
+  instead of the source. `path` holds the cells the previous grain passed
+  through, and is updated for the next one.
+
+  Only the cell the previous grain stopped in has changed, and only the cell
+  just above it on the path could have moved there, so the path up to that
+  cell is still the way every grain goes.
+  """
+  if not path:
+    path.append((500, 0))
+  sand_x, sand_y = path[-1]
+  while True:
+    next_coords = do_one_sand_tick(sparse_grid, sand_x, sand_y, max_y)
+    # Stopped!
+    if next_coords == (sand_x, sand_y):
+      path.pop()
+      return sand_y <= max_y, next_coords != (500, 0)
+    path.append(next_coords)
+    sand_x, sand_y = next_coords
+
+
 def do_one_sand_tick(sparse_grid: dict[int, dict[int, str]], sand_x: int, sand_y: int, max_y: int) -> tuple[int, int]:
   """
   Does a single tick of sand, returning the next coordinate of the sand, or
@@ -51,23 +79,147 @@ def do_one_sand_tick(sparse_grid: dict[int, dict[int, str]], sand_x: int, sand_y
   
 
 
+@dataclass
+class DenseGrid:
+  """
+  The cave as one byte per cell, row-major, from x = min_x and y = 0 down to
+  and including the floor. It's wide enough that sand can never reach the
+  left or right edge.
+  """
+  min_x: int
+  width: int
+  height: int
+  cells: bytearray
+
+  @staticmethod
+  def bounds(rocks: list[tuple[int, int]]) -> tuple[int, int, int]:
+    """Returns the min_x, width and height of a DenseGrid for these rocks."""
+    floor_y = max(y for _, y in rocks) + 2
+    # Sand moves at most one column per row, so stays within floor_y - 1 of
+    # the source. Leave a column beyond that on each side.
+    min_x = min(min(x for x, _ in rocks), 500 - floor_y)
+    max_x = max(max(x for x, _ in rocks), 500 + floor_y)
+    return min_x, max_x - min_x + 1, floor_y + 1
+
+  @classmethod
+  def build(cls, rocks: list[tuple[int, int]]) -> "DenseGrid":
+    min_x, width, height = cls.bounds(rocks)
+    grid = cls(min_x=min_x, width=width, height=height, cells=bytearray(b"." * (width * height)))
+    for x, y in rocks:
+      grid.cells[grid.index(x, y)] = ROCK
+    # Floor.
+    grid.cells[(height - 1) * width:] = b"#" * width
+    grid.cells[grid.index(500, 0)] = SOURCE
+    return grid
+
+  def index(self, x: int, y: int) -> int:
+    return y * self.width + x - self.min_x
+
+  def get(self, x: int, y: int) -> str:
+    if not self.min_x <= x < self.min_x + self.width:
+      return "."
+    return chr(self.cells[self.index(x, y)])
+
+
+# Cell values in a DenseGrid.
+AIR = ord(".")
+ROCK = ord("#")
+SAND = ord("O")
+SOURCE = ord("+")
+
+
+def do_one_sand_dense(grid: DenseGrid, max_y: int) -> tuple[bool, bool]:
+  """
+  Same as do_one_sand, on a DenseGrid.
+  """
+  cells = grid.cells
+  width = grid.width
+  source = grid.index(500, 0)
+  index = source
+  while True:
+    below = index + width
+    if cells[below] == AIR:
+      index = below
+    elif cells[below - 1] == AIR:
+      index = below - 1
+    elif cells[below + 1] == AIR:
+      index = below + 1
+    else:
+      break
+  cells[index] = SAND
+  return index // width <= max_y, index != source
+
+
+def do_one_sand_dense_path(grid: DenseGrid, max_y: int, path: list[int]) -> tuple[bool, bool]:
+  """
+  Same as do_one_sand_path, on a DenseGrid; `path` holds cell indexes.
+  """
+  cells = grid.cells
+  width = grid.width
+  source = grid.index(500, 0)
+  if not path:
+    path.append(source)
+  index = path[-1]
+  while True:
+    below = index + width
+    if cells[below] == AIR:
+      index = below
+    elif cells[below - 1] == AIR:
+      index = below - 1
+    elif cells[below + 1] == AIR:
+      index = below + 1
+    else:
+      break
+    path.append(index)
+  cells[index] = SAND
+  path.pop()
+  return index // width <= max_y, index != source
+
+
 def parse_coord(coord_pair: str) -> tuple[int, int]:
   splits = tuple(int(val) for val in coord_pair.split(","))
   assert len(splits), 2
   return splits
 
 
-def print_grid(sparse_grid: dict[int, dict[int, str]], xrange: tuple[int, int], yrange: tuple[int, int]) -> None:
+def grid_row(grid: Union[dict[int, dict[int, str]], DenseGrid], y: int, xrange: tuple[int, int]) -> bytes:
+  """Returns one character per cell of a grid row."""
+  if isinstance(grid, DenseGrid):
+    if grid.min_x <= xrange[0] and xrange[1] <= grid.min_x + grid.width:
+      return bytes(grid.cells[grid.index(xrange[0], y):grid.index(xrange[1], y)])
+    return "".join(grid.get(x, y) for x in range(*xrange)).encode()
+  row = grid[y]
+  return "".join(row.get(x, ".") for x in range(*xrange)).encode()
+
+
+def render_grid(grid: Union[dict[int, dict[int, str]], DenseGrid], xrange: tuple[int, int], yrange: tuple[int, int]) -> str:
+  """Renders a grid as text, each cell followed by a space."""
+  lines = []
   for y in range(*yrange):
-    for x in range(*xrange):
-      print(sparse_grid[y].get(x, "."), end="")
-      print(" ", end="")
-    print()
+    lines.append(" ".join(grid_row(grid, y, xrange).decode()) + " \n")
+  return "".join(lines)
 
 
-def main():
-  sparse_grid: dict[int, dict[int, str]] = defaultdict(dict)
-  with open("input.txt", "r") as infile:
+def print_grid(grid: Union[dict[int, dict[int, str]], DenseGrid], xrange: tuple[int, int], yrange: tuple[int, int]) -> None:
+  sys.stdout.write(render_grid(grid, xrange, yrange))
+
+
+# Gray level for each kind of cell in an image.
+IMAGE_SHADES = bytes.maketrans(b".#O+", bytes((255, 0, 160, 80)))
+
+
+def write_image(grid: Union[dict[int, dict[int, str]], DenseGrid], filename: str, xrange: tuple[int, int], yrange: tuple[int, int]) -> None:
+  """Writes a grid as a binary PGM image, one pixel per cell."""
+  with open(filename, "wb") as outfile:
+    outfile.write(f"P5\n{xrange[1] - xrange[0]} {yrange[1] - yrange[0]}\n255\n".encode())
+    for y in range(*yrange):
+      outfile.write(grid_row(grid, y, xrange).translate(IMAGE_SHADES))
+
+
+def read_rocks(filename: str) -> list[tuple[int, int]]:
+  """Returns the coordinates of every rock cell in a scan."""
+  rocks = []
+  with open(filename, "r") as infile:
     for line in infile:
        line = line.strip("\n")
        coords = line.split(" -> ")
@@ -80,57 +232,214 @@ def main():
            # Vertical line.
            y_starts = sorted((curr_coord[1], next_coord[1]))
            for y in range(y_starts[0], y_starts[1] + 1):
-             sparse_grid[y][curr_coord[0]] = "#"
+             rocks.append((curr_coord[0], y))
          else:
            assert curr_coord[1] == next_coord[1]
            # Horizontal line.
            x_starts = sorted((curr_coord[0], next_coord[0]))
            for x in range(x_starts[0], x_starts[1] + 1):
-             sparse_grid[curr_coord[1]][x] = "#"
+             rocks.append((x, curr_coord[1]))
          curr_coord = next_coord
+  return rocks
 
-  min_x = min(
-    x for row in sparse_grid.values() for x in row.keys()
-  )
-  max_x = max(
-    x for row in sparse_grid.values() for x in row.keys()
-  )
-  min_y = 0
-  max_y = max(sparse_grid.keys())
 
-  print(f"done. xrange - {min_x}, {max_x}. yrange - {min_y}, {max_y}")
+def count_reachable(rocks: list[tuple[int, int]]) -> int:
+  """
+  Returns the P2 answer without dropping any sand. Sand comes to rest in
+  exactly the cells it can reach from the source: air cells with an air cell
+  it reached above, above-left or above-right. So sweep down the rows with
+  each row as a bitset, until the floor.
+  """
+  floor_y = max(y for _, y in rocks) + 2
+  # Bit 0 is the leftmost column sand could reach.
+  min_x = 500 - floor_y
+  rock_rows: dict[int, int] = defaultdict(int)
+  for x, y in rocks:
+    if x >= min_x:
+      rock_rows[y] |= 1 << (x - min_x)
+
+  reachable = 1 << (500 - min_x)
+  total = 1
+  for y in range(1, floor_y):
+    reachable = (reachable | (reachable << 1) | (reachable >> 1)) & ~rock_rows[y]
+    total += reachable.bit_count()
+  return total
 
-  for y in range(min_y, max_y + 1):
+
+def random_rocks(depth: int, seed: int = 0) -> list[tuple[int, int]]:
+  """
+  Builds rocks for a random cave about `depth` rows deep, with a shelf under
+  the source so sand piles up before any of it falls past the rocks.
+  """
+  rng = random.Random(seed)
+  shelf_y = depth // 2
+  rocks = [(x, shelf_y) for x in range(500 - depth // 10, 500 + depth // 10 + 1)]
+  for _ in range(depth // 2):
+    x = rng.randint(500 - depth // 3, 500 + depth // 3)
+    y = rng.randint(depth // 20 + 1, depth)
+    length = rng.randint(1, 10)
+    if rng.random() < 0.5:
+      rocks.extend((x + i, y) for i in range(length))
+    else:
+      rocks.extend((x, y + i) for i in range(length))
+  return rocks
+
+
+# Largest DenseGrid to build when picking a grid automatically.
+DENSE_LIMIT = 1 << 28
+
+
+def make_drop(rocks: list[tuple[int, int]], use_dense: bool, drop: str):
+  """
+  Sets up a grid for the rocks, returning it and a function that drops one
+  grain of sand into it (see do_one_sand).
+  """
+  min_x = min(x for x, _ in rocks)
+  max_x = max(x for x, _ in rocks)
+  max_y = max(y for _, y in rocks)
+  path = []
+  if use_dense:
+    grid = DenseGrid.build(rocks)
+    if drop == "path":
+      return grid, lambda: do_one_sand_dense_path(grid, max_y, path)
+    return grid, lambda: do_one_sand_dense(grid, max_y)
+
+  sparse_grid: dict[int, dict[int, str]] = defaultdict(dict)
+  for x, y in rocks:
+    sparse_grid[y][x] = "#"
+  for y in range(0, max_y + 1):
     row = sparse_grid[y] 
     for x in range(min_x, max_x + 1):
       if x not in row:
         row[x] = "."
     assert len(row) == max_x - min_x + 1, f"row {y} has length {len(row)}; expected {max_x - min_x + 1}"
-  assert len(sparse_grid) == max_y - min_y + 1
+  assert len(sparse_grid) == max_y + 1
   # Start of my sand.
   sparse_grid[0][500] = "+"
+  if drop == "path":
+    return sparse_grid, lambda: do_one_sand_path(sparse_grid, max_y, path)
+  return sparse_grid, lambda: do_one_sand(sparse_grid, max_y)
 
-  print("Starting grid -\n")
-  print_grid(sparse_grid, (min_x, max_x + 1), (min_y, max_y + 1))
 
+def simulate(drop_sand: Callable[[], tuple[bool, bool]], progress: bool = True) -> tuple[int, int]:
+  """
+  Drops sand until the source is blocked, returning the grain that first
+  passed the lowest rock and the grain that blocked the source.
+  """
   counter = 0
   hit_floor_at = -1
   ended_at = -1
   while ended_at < 0:
     counter += 1 
-    not_hit_floor, not_hit_top = do_one_sand(sparse_grid, max_y)
-    if counter % 10 == 0:
-      print(".", end="")
+    not_hit_floor, not_hit_top = drop_sand()
+    if progress and counter % 10 == 0:
+      sys.stdout.write(".")
 
     if not not_hit_floor and hit_floor_at < 0:
       hit_floor_at = counter
     if not not_hit_top:
       ended_at = counter
+  return hit_floor_at, ended_at
+
+
+def benchmark_drops(depth: int) -> None:
+  """Times each grid and drop mode on a random cave."""
+  rocks = random_rocks(depth)
+  expected = None
+  for use_dense in (False, True):
+    for drop in ("full", "path"):
+      _, drop_sand = make_drop(rocks, use_dense, drop)
+      start = time.perf_counter()
+      answers = simulate(drop_sand, progress=False)
+      elapsed = time.perf_counter() - start
+      expected = expected or answers
+      assert answers[0] > 1, f"first grain fell through, so P1 isn't tested: {answers}"
+      assert answers == expected, f"answers differ: {answers} != {expected}"
+      grid_name = "dense" if use_dense else "sparse"
+      print(f"{grid_name:>6} {drop}: {elapsed:.2f}s; grains = {answers}")
+
+  start = time.perf_counter()
+  reachable = count_reachable(rocks)
+  elapsed = time.perf_counter() - start
+  assert reachable == expected[1], f"reachable {reachable} != {expected[1]}"
+  print(f"reachable: {elapsed:.2f}s; P2 = {reachable}")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    "--grid",
+    choices=("auto", "dense", "sparse"),
+    default="auto",
+    help="dense byte grid, sparse dicts, or dense unless it would be huge",
+  )
+  parser.add_argument(
+    "--drop",
+    choices=("full", "path"),
+    default="path",
+    help="drop each grain from the source, or resume along the last grain's path",
+  )
+  parser.add_argument(
+    "--p2-only",
+    action="store_true",
+    help="count P2 grains by reachability, without simulating or printing grids",
+  )
+  parser.add_argument(
+    "--quiet", action="store_true", help="skip grids and progress output"
+  )
+  parser.add_argument(
+    "--image", metavar="PATH", help="write the final grid to PATH as a PGM image"
+  )
+  parser.add_argument(
+    "--bench",
+    type=int,
+    metavar="DEPTH",
+    help="time each grid and drop mode on a random cave DEPTH rows deep, then exit",
+  )
+  args = parser.parse_args()
+
+  if args.bench:
+    benchmark_drops(args.bench)
+    return
+
+  rocks = read_rocks("input.txt")
+
+  if args.p2_only:
+    print(f"P2 answer = {count_reachable(rocks)}")
+    return
+
+  _, dense_width, dense_height = DenseGrid.bounds(rocks)
+  use_dense = args.grid == "dense" or (
+    args.grid == "auto" and dense_width * dense_height <= DENSE_LIMIT
+  )
+
+  min_x = min(x for x, _ in rocks)
+  max_x = max(x for x, _ in rocks)
+  min_y = 0
+  max_y = max(y for _, y in rocks)
+
+  print(f"done. xrange - {min_x}, {max_x}. yrange - {min_y}, {max_y}")
+
+  grid, drop_sand = make_drop(rocks, use_dense, args.drop)
+
+  if not args.quiet:
+    print("Starting grid -\n")
+    print_grid(grid, (min_x, max_x + 1), (min_y, max_y + 1))
+
+  hit_floor_at, ended_at = simulate(drop_sand, progress=not args.quiet)
+
+  if not args.quiet:
+    print("Ending grid -\n")
+    print_grid(grid, (min_x, max_x + 1), (min_y, max_y + 2))
 
-  print("Ending grid -\n")
-  print_grid(sparse_grid, (min_x, max_x + 1), (min_y, max_y + 2))
+  if args.image:
+    # Everywhere sand could have reached, above the floor.
+    image_min_x, image_width, image_height = DenseGrid.bounds(rocks)
+    write_image(
+      grid, args.image, (image_min_x, image_min_x + image_width), (min_y, image_height - 1)
+    )
 
-  print(f"done at sand {counter}.")
+  print(f"done at sand {ended_at}.")
   print(f"{hit_floor_at} hit the floor (P1 answer = {hit_floor_at - 1}).")
   print(f"{ended_at} hit the ceiling (P2 answer = {ended_at}).")
 
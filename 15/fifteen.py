@@ -1,7 +1,18 @@
 #!/usr/bin/env python3
 
-from dataclasses import dataclass
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+import multiprocessing
+import multiprocessing.synchronize
 import re
+from typing import Optional
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 
 @dataclass
@@ -9,15 +20,14 @@ class Sensor:
   x: int
   y: int
   beacon_dist: int
+  beacon_x: int
+  beacon_y: int
 
 
-def p1():
+def read_sensors() -> list[Sensor]:
   sensor_pattern = re.compile(r"^Sensor at x=(-?\d+), y=(-?\d+): closest beacon is at x=(-?\d+), y=(-?\d+)$")
-  
-  target_y = 2000000
-  # Projected ranges on target, as inclusive range pairs.
-  ranges: list[tuple[int, int]] = []
-  beacons_on_target: set[int] = set()
+
+  sensors = []
   with open("input.txt", "r") as infile:
     for line in infile:
       match = sensor_pattern.search(line)
@@ -27,102 +37,403 @@ def p1():
       beacon_x = int(match.group(3))
       beacon_y= int(match.group(4))
       distance_to_beacon = abs(sensor_x - beacon_x) + abs(sensor_y - beacon_y) 
-      if beacon_y == target_y:
-        beacons_on_target.add(beacon_x)
-      assert sensor_y != target_y
-
-      distance_to_target = abs(target_y - sensor_y)
-      projection = distance_to_beacon - distance_to_target
-      if projection > 0:
-        ranges.append([sensor_x - projection, sensor_x + projection])
-
-  ranges = sorted(ranges)
-  pruned_ranges = []
-  curr_range = ranges[0]
-  for r in ranges[1:]:
-    if curr_range[1] >= r[0]:
-      # Overlap; merge if needed.
-      if curr_range[1] < r[1]:
-        curr_range[1] = r[1]
-    else:
-      # No overlap; start new range.
-      pruned_ranges.append(curr_range)
-      curr_range = r
+      sensors.append(Sensor(
+        x=sensor_x, y=sensor_y, beacon_dist=distance_to_beacon, beacon_x=beacon_x, beacon_y=beacon_y
+      ))
+  return sensors
+
+
+@dataclass
+class IntervalSet:
+  """
+  Inclusive integer intervals, as parallel arrays of starts and ends.
+  Inserts are appended as they come; merge() sorts and coalesces them,
+  joining touching intervals too, and the queries merge first.
+  """
+  starts: array = field(default_factory=lambda: array("q"))
+  ends: array = field(default_factory=lambda: array("q"))
+  merged: bool = True
+
+  def insert(self, lo: int, hi: int) -> None:
+    if lo > hi:
+      return
+    self.starts.append(lo)
+    self.ends.append(hi)
+    self.merged = False
+
+  def merge(self) -> None:
+    if self.merged:
+      return
+    starts = array("q")
+    ends = array("q")
+    for lo, hi in sorted(zip(self.starts, self.ends)):
+      if ends and ends[-1] + 1 >= lo:
+        # Overlapping or touching; extend if needed.
+        if ends[-1] < hi:
+          ends[-1] = hi
+      else:
+        starts.append(lo)
+        ends.append(hi)
+    self.starts = starts
+    self.ends = ends
+    self.merged = True
 
-  pruned_ranges.append(curr_range)
+  def covered_length(self) -> int:
+    self.merge()
+    return sum(self.ends) - sum(self.starts) + len(self.starts)
 
-  total_len = -len(beacons_on_target)
-  for r in pruned_ranges:
-    total_len += r[1] - r[0] + 1
+  def gaps(self, lo: int, hi: int) -> list[tuple[int, int]]:
+    """Returns the uncovered inclusive ranges within [lo, hi]."""
+    self.merge()
+    gaps = []
+    next_x = lo
+    for start, end in zip(self.starts, self.ends):
+      if end < next_x:
+        continue
+      if start > hi:
+        break
+      if start > next_x:
+        gaps.append((next_x, start - 1))
+      next_x = end + 1
+    if next_x <= hi:
+      gaps.append((next_x, hi))
+    return gaps
+
+
+def row_intervals(sensors: list[Sensor], y: int) -> IntervalSet:
+  """Returns the x ranges the sensors cover in row y."""
+  intervals = IntervalSet()
+  for sensor in sensors:
+    projection = sensor.beacon_dist - abs(y - sensor.y)
+    if projection >= 0:
+      intervals.insert(sensor.x - projection, sensor.x + projection)
+  return intervals
+
+
+def p1(sensors: list[Sensor], target_y: int):
+  beacons_on_target = {sensor.beacon_x for sensor in sensors if sensor.beacon_y == target_y}
+  total_len = row_intervals(sensors, target_y).covered_length() - len(beacons_on_target)
 
   print(f"P1 = {total_len}")
 
 
-def p2():
-  sensor_pattern = re.compile(r"^Sensor at x=(-?\d+), y=(-?\d+): closest beacon is at x=(-?\d+), y=(-?\d+)$")
+def sensor_arrays(sensors: list[Sensor]) -> tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+  """Returns sensor x, y and beacon distance as arrays."""
+  assert np is not None, "--numpy needs numpy installed"
+  return (
+    np.array([sensor.x for sensor in sensors], dtype=np.int64),
+    np.array([sensor.y for sensor in sensors], dtype=np.int64),
+    np.array([sensor.beacon_dist for sensor in sensors], dtype=np.int64),
+  )
+
+
+def block_intervals(
+  xs: "np.ndarray", ys: "np.ndarray", dists: "np.ndarray", rows: "np.ndarray", lo_bound: int, hi_bound: int
+) -> tuple["np.ndarray", "np.ndarray"]:
+  """
+  Projects every sensor onto every row in `rows`, clipped to [lo_bound,
+  hi_bound]. Returns (rows x sensors) arrays of inclusive interval starts and
+  ends, sorted by start along each row. Sensors that don't reach a row get
+  an empty interval (start past hi_bound, end before lo_bound) that sorts
+  last.
+  """
+  projection = dists[None, :] - np.abs(rows[:, None] - ys[None, :])
+  lo = xs[None, :] - projection
+  hi = xs[None, :] + projection
+  empty = (projection < 0) | (hi < lo_bound) | (lo > hi_bound)
+  lo = np.where(empty, hi_bound + 1, np.maximum(lo, lo_bound))
+  hi = np.where(empty, lo_bound - 1, np.minimum(hi, hi_bound))
+  order = np.argsort(lo, axis=1, kind="stable")
+  return np.take_along_axis(lo, order, axis=1), np.take_along_axis(hi, order, axis=1)
 
-  sensors = []
-  with open("input.txt", "r") as infile:
-    for line in infile:
-      match = sensor_pattern.search(line)
-      assert match is not None, f"bad line {line}"
-      sensor_x = int(match.group(1))
-      sensor_y = int(match.group(2))
-      beacon_x = int(match.group(3))
-      beacon_y= int(match.group(4))
-      distance_to_beacon = abs(sensor_x - beacon_x) + abs(sensor_y - beacon_y) 
-      sensors.append(Sensor(x=sensor_x, y=sensor_y, beacon_dist=distance_to_beacon))
 
-  max_candidate = 4000000
+def p1_numpy(sensors: list[Sensor], target_y: int):
+  xs, ys, dists = sensor_arrays(sensors)
+  # Unbounded, as far as any sensor can reach.
+  lo_bound = int((xs - dists).min())
+  hi_bound = int((xs + dists).max())
+  lo, hi = block_intervals(xs, ys, dists, np.array([target_y]), lo_bound, hi_bound)
+  lo, hi = lo[0], hi[0]
+  # Each interval only adds what's past the furthest end before it.
+  furthest = np.maximum.accumulate(hi)
+  before = np.concatenate(([lo_bound - 1], furthest[:-1]))
+  added = hi - np.maximum(lo, before + 1) + 1
+  beacons_on_target = {sensor.beacon_x for sensor in sensors if sensor.beacon_y == target_y}
+  total_len = int(added[added > 0].sum()) - len(beacons_on_target)
+
+  print(f"P1 = {total_len}")
 
+
+def uncovered_in_block(
+  xs: "np.ndarray", ys: "np.ndarray", dists: "np.ndarray", rows: "np.ndarray", max_candidate: int
+) -> list[tuple[int, int]]:
+  """
+  Returns the uncovered points in each of the given rows, within
+  [0, max_candidate]. Every gap must be one point wide.
+  """
+  lo, hi = block_intervals(xs, ys, dists, rows, 0, max_candidate)
+  furthest = np.maximum.accumulate(hi, axis=1)
+  gap_rows = []
+  gap_los = []
+  gap_his = []
+  # Rows no sensor reaches; empty intervals start past max_candidate.
+  empty = lo[:, 0] > max_candidate
+  gap_rows.append(rows[empty])
+  gap_los.append(np.zeros(empty.sum(), dtype=np.int64))
+  gap_his.append(np.full(empty.sum(), max_candidate, dtype=np.int64))
+  # Before the first interval.
+  starts = (lo[:, 0] > 0) & ~empty
+  gap_rows.append(rows[starts])
+  gap_los.append(np.zeros(starts.sum(), dtype=np.int64))
+  gap_his.append(lo[starts, 0] - 1)
+  # Between intervals.
+  between = (lo[:, 1:] > furthest[:, :-1] + 1) & (lo[:, 1:] <= max_candidate)
+  row_i, col_i = np.nonzero(between)
+  gap_rows.append(rows[row_i])
+  gap_los.append(furthest[row_i, col_i] + 1)
+  gap_his.append(lo[row_i, col_i + 1] - 1)
+  # After the last interval.
+  ends = (furthest[:, -1] < max_candidate) & ~empty
+  gap_rows.append(rows[ends])
+  gap_los.append(furthest[ends, -1] + 1)
+  gap_his.append(np.full(ends.sum(), max_candidate, dtype=np.int64))
+
+  gap_rows = np.concatenate(gap_rows)
+  gap_los = np.concatenate(gap_los)
+  gap_his = np.concatenate(gap_his)
+  wide = gap_his != gap_los
+  assert not wide.any(), (
+    f"more than one answer: gaps {list(zip(gap_los[wide].tolist(), gap_his[wide].tolist()))} "
+    f"in rows {gap_rows[wide].tolist()}"
+  )
+  return sorted(zip(gap_los.tolist(), gap_rows.tolist()))
+
+
+def p2_numpy(sensors: list[Sensor], max_candidate: int):
+  xs, ys, dists = sensor_arrays(sensors)
+  # Enough rows per block for a few million sensor intervals.
+  block_size = max(1, (1 << 22) // len(sensors))
   candidates = []
+  for block_start in range(0, max_candidate + 1, block_size):
+    rows = np.arange(block_start, min(block_start + block_size, max_candidate + 1), dtype=np.int64)
+    candidates.extend(uncovered_in_block(xs, ys, dists, rows, max_candidate))
+    assert len(candidates) <= 1, f"found more than one answer: {candidates}"
 
-  for y in range(0, max_candidate + 1):
-    ranges = []
-    # Check row.
+  assert len(candidates) == 1, f"found more than one answer: {candidates}"
+
+  print(f"P2 = {candidates[0][0] * 4000000 + candidates[0][1]}")
+
+
+def is_covered(sensors: list[Sensor], x: int, y: int) -> bool:
+  return any(abs(x - sensor.x) + abs(y - sensor.y) <= sensor.beacon_dist for sensor in sensors)
+
+
+def gap_ends(intervals: IntervalSet, lo: int, hi: int) -> list[int]:
+  """Returns both ends of every gap in [lo, hi]."""
+  ends = []
+  for gap_lo, gap_hi in intervals.gaps(lo, hi):
+    ends.extend((gap_lo, gap_hi) if gap_lo != gap_hi else (gap_lo,))
+  return ends
+
+
+def diagonal_gaps(sensors: list[Sensor], slope: int, c: int, max_candidate: int) -> list[tuple[int, int]]:
+  """
+  Returns both ends of every uncovered run along y = slope * x + c (slope is
+  1 or -1), within [0, max_candidate].
+  """
+  if slope == 1:
+    lo_x, hi_x = max(0, -c), min(max_candidate, max_candidate - c)
+  else:
+    lo_x, hi_x = max(0, c - max_candidate), min(max_candidate, c)
+  if lo_x > hi_x:
+    return []
+  intervals = IntervalSet()
+  for sensor in sensors:
+    # With u = x - sensor.x, the line is inside the diamond where
+    # |u| + |u - k| <= beacon_dist.
+    k = slope * (sensor.y - c) - sensor.x
+    if abs(k) <= sensor.beacon_dist:
+      intervals.insert(
+        sensor.x - (sensor.beacon_dist - k) // 2, sensor.x + (k + sensor.beacon_dist) // 2
+      )
+  return [(x, slope * x + c) for x in gap_ends(intervals, lo_x, hi_x)]
+
+
+def boundary_candidates(sensors: list[Sensor], max_candidate: int) -> list[tuple[int, int]]:
+  """
+  Returns uncovered points in [0, max_candidate]: both ends of every
+  uncovered run along the lines just outside the sensor diamonds, and along
+  the edges of the search area. That isn't every uncovered point, but it's
+  every one if there's only one, and more than one otherwise.
+
+  The leftmost (then topmost) point of any uncovered region has a covered
+  point or the edge to its left, so it's on one of those lines, and likewise
+  the rightmost. A region of more than one point has two different ones.
+  """
+  # Lines y - x = c and y + x = c just outside each diamond.
+  rising = set()
+  falling = set()
+  for sensor in sensors:
+    reach = sensor.beacon_dist + 1
+    rising.update((sensor.y - sensor.x - reach, sensor.y - sensor.x + reach))
+    falling.update((sensor.y + sensor.x - reach, sensor.y + sensor.x + reach))
+
+  candidates = set()
+  for c in rising:
+    candidates.update(diagonal_gaps(sensors, 1, c, max_candidate))
+  for c in falling:
+    candidates.update(diagonal_gaps(sensors, -1, c, max_candidate))
+  # Edges of the search area.
+  for edge in (0, max_candidate):
+    candidates.update((x, edge) for x in gap_ends(row_intervals(sensors, edge), 0, max_candidate))
+    column = IntervalSet()
     for sensor in sensors:
-      distance_to_target = abs(y - sensor.y)
-      projection = sensor.beacon_dist - distance_to_target
-      if projection > 0:
-        projected_x_min = max(sensor.x - projection, 0)
-        projected_x_max = min(sensor.x + projection, max_candidate)
-        ranges.append([projected_x_min, projected_x_max])
-    ranges = sorted(ranges)
-    pruned_ranges = []
-    curr_range = ranges[0]
-    for r in ranges[1:]:
-      if curr_range[1] >= r[0]:
-        # Overlap; merge if needed.
-        if curr_range[1] < r[1]:
-          curr_range[1] = r[1]
-      else:
-        # No overlap; start new range.
-        pruned_ranges.append(curr_range)
-        curr_range = r
-
-    pruned_ranges.append(curr_range)
-    if len(pruned_ranges) != 1:
-      assert len(pruned_ranges) == 2, f"more than one answer: {pruned_ranges}"
-      assert pruned_ranges[0][0] == 0, f"more than one answer: {pruned_ranges}"
-      assert pruned_ranges[1][1] == max_candidate, f"more than one answer: {pruned_ranges}"
-      candidate_x = pruned_ranges[0][1] + 1
-      candidates.append((candidate_x, y))
-    elif pruned_ranges[0][0] != 0:
-      print(f"found candidate at ({pruned_ranges[0][0]}, {y}).")
-      assert pruned_ranges[0][0] == 1, f"bad range at {y}: {pruned_ranges}"
-      candidates.append((0, y))
-    elif pruned_ranges[0][1] != max_candidate:
-      assert pruned_ranges[0][1] == max_candidate - 1, f"bad range at {y}: {pruned_ranges}"
-      candidates.append((max_candidate, y))
+      projection = sensor.beacon_dist - abs(edge - sensor.x)
+      if projection >= 0:
+        column.insert(sensor.y - projection, sensor.y + projection)
+    candidates.update((edge, y) for y in gap_ends(column, 0, max_candidate))
+  return sorted(candidates)
+
+
+def p2_geometric(sensors: list[Sensor], max_candidate: int):
+  candidates = boundary_candidates(sensors, max_candidate)
+  assert len(candidates) == 1, f"expected one answer, found: {candidates}"
+
+  print(f"P2 = {candidates[0][0] * 4000000 + candidates[0][1]}")
+
+
+def row_candidates(sensors: list[Sensor], y: int, max_candidate: int) -> list[tuple[int, int]]:
+  """Returns the uncovered points in row y, within [0, max_candidate]."""
+  gaps = row_intervals(sensors, y).gaps(0, max_candidate)
+  for lo, hi in gaps:
+    assert lo == hi, f"more than one answer at {y}: {gaps}"
+  return [(lo, y) for lo, _ in gaps]
+
+
+def p2(sensors: list[Sensor], max_candidate: int):
+  candidates = []
+
+  for y in range(0, max_candidate + 1):
+    candidates.extend(row_candidates(sensors, y, max_candidate))
+
+  assert len(candidates) == 1, f"found more than one answer: {candidates}"
+
+  print(f"P2 = {candidates[0][0] * 4000000 + candidates[0][1]}")
+
+
+# Sensors for pool workers (and as arrays, for --numpy), and an event set
+# once any worker finds a candidate. Set once per worker by init_row_worker.
+worker_sensors: list[Sensor] = []
+worker_arrays: Optional[tuple["np.ndarray", "np.ndarray", "np.ndarray"]] = None
+worker_found: Optional[multiprocessing.synchronize.Event] = None
+
+
+def init_row_worker(
+  sensors: list[Sensor], use_numpy: bool, found: multiprocessing.synchronize.Event
+) -> None:
+  global worker_sensors, worker_arrays, worker_found
+  worker_sensors = sensors
+  if use_numpy:
+    worker_arrays = sensor_arrays(sensors)
+  worker_found = found
+
+
+def scan_rows(start: int, stop: int, max_candidate: int, use_numpy: bool) -> list[tuple[int, int]]:
+  """
+  Pool task: returns the uncovered points in rows [start, stop). Gives up
+  early, with what it has, once any worker has found a candidate.
+  """
+  candidates = []
+  check_every = 1000
+  for block_start in range(start, stop, check_every):
+    if worker_found.is_set():
+      break
+    block_stop = min(block_start + check_every, stop)
+    if use_numpy:
+      xs, ys, dists = worker_arrays
+      rows = np.arange(block_start, block_stop, dtype=np.int64)
+      candidates.extend(uncovered_in_block(xs, ys, dists, rows, max_candidate))
+    else:
+      for y in range(block_start, block_stop):
+        candidates.extend(row_candidates(worker_sensors, y, max_candidate))
+    if candidates:
+      worker_found.set()
+      break
+  return candidates
+
+
+def p2_parallel(sensors: list[Sensor], max_candidate: int, workers: int, use_numpy: bool):
+  """
+  Scans rows in chunks across a process pool, stopping once a candidate
+  turns up. Rows left unscanned are covered by checking the answer is the
+  only point boundary_candidates finds.
+  """
+  found = multiprocessing.Event()
+  chunk_rows = 20000
+  candidates = []
+  with ProcessPoolExecutor(
+    workers, initializer=init_row_worker, initargs=(sensors, use_numpy, found)
+  ) as pool:
+    futures = [
+      pool.submit(scan_rows, start, min(start + chunk_rows, max_candidate + 1), max_candidate, use_numpy)
+      for start in range(0, max_candidate + 1, chunk_rows)
+    ]
+    for future in as_completed(futures):
+      # as_completed still yields the chunks cancelled below.
+      if future.cancelled():
+        continue
+      candidates.extend(future.result())
+      if candidates:
+        for other in futures:
+          other.cancel()
 
   assert len(candidates) == 1, f"found more than one answer: {candidates}"
+  boundary = boundary_candidates(sensors, max_candidate)
+  assert boundary == candidates, f"answer {candidates} isn't unique: {boundary}"
 
   print(f"P2 = {candidates[0][0] * 4000000 + candidates[0][1]}")
 
 
 def main():
-  p1()
-  p2()
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--target-row", type=int, default=2000000, help="row to count for P1")
+  parser.add_argument(
+    "--max-candidate", type=int, default=4000000, help="P2 searches x and y in [0, this]"
+  )
+  parser.add_argument(
+    "--p2",
+    choices=("geometric", "rows"),
+    default="geometric",
+    help="intersect sensor boundaries, or scan every row",
+  )
+  parser.add_argument(
+    "--numpy",
+    action="store_true",
+    help="project sensors onto blocks of rows with numpy for P1 and the P2 row scan",
+  )
+  parser.add_argument(
+    "--workers",
+    type=int,
+    default=0,
+    help="split the P2 row scan (--p2 rows) across this many processes",
+  )
+  args = parser.parse_args()
+  if args.workers > 0 and args.p2 == "geometric":
+    parser.error("--workers only applies to --p2 rows")
+
+  sensors = read_sensors()
+  if args.numpy:
+    p1_numpy(sensors, args.target_row)
+  else:
+    p1(sensors, args.target_row)
+  if args.p2 == "geometric":
+    p2_geometric(sensors, args.max_candidate)
+  elif args.workers > 0:
+    p2_parallel(sensors, args.max_candidate, args.workers, args.numpy)
+  elif args.numpy:
+    p2_numpy(sensors, args.max_candidate)
+  else:
+    p2(sensors, args.max_candidate)
 
 
 if __name__ == '__main__':
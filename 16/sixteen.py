@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 
+import argparse
+from collections import deque
 from dataclasses import dataclass, field
 import re
-from typing import Optional
+import sys
+import time
+from typing import Callable
 
 
 @dataclass
@@ -10,16 +14,101 @@ class Valve:
   name: str
   rate: int
   links: list["Valve"] = field(default_factory=list)
+  # Valves worth opening, best rate first, with the minutes it takes to walk
+  # to each. Set by compress_valves.
+  targets: list[tuple["Valve", int]] = field(default_factory=list)
+  # Position among the valves worth opening (the start goes after them), and
+  # this valve's bit in State.open_valves. Set by compress_valves.
+  index: int = 0
+  bit: int = 0
+  # Minutes to walk to each valve worth opening, by index; past any time
+  # limit if it can't be reached. Set by compress_valves.
+  distance_to: list[int] = field(default_factory=list)
+
+
+def walk_distances(start: Valve) -> dict[str, int]:
+  """Returns the minutes to walk from start to every reachable valve, by name."""
+  distances = {start.name: 0}
+  queue = deque([start])
+  while len(queue) > 0:
+    valve = queue.popleft()
+    for link in valve.links:
+      if link.name not in distances:
+        distances[link.name] = distances[valve.name] + 1
+        queue.append(link)
+  return distances
+
+
+def compress_valves(starting_valve: Valve, best_valves: list[Valve]) -> None:
+  """
+  Links the starting valve and every valve worth opening straight to the
+  valves worth opening, so the searches never walk through zero-rate rooms.
+  """
+  for index, valve in enumerate(best_valves):
+    valve.index = index
+    valve.bit = 1 << index
+  starting_valve.index = len(best_valves)
+  for valve in [starting_valve] + best_valves:
+    distances = walk_distances(valve)
+    valve.targets = [
+      (target, distances[target.name])
+      for target in best_valves
+      if target is not valve and target.name in distances
+    ]
+    valve.distance_to = [distances.get(target.name, 1 << 30) for target in best_valves]
 
 
 @dataclass
 class State:
-  current_valve: Valve
-  elephant_valve: Optional[Valve] = None
-  # Pressure released through the 30 minutes.
+  """
+  Each agent stands at a valve it has already opened (or the start), and its
+  minute is when it finished opening it. Agents are kept soonest first (then
+  by valve), so the first one moves next, and states that only differ in the
+  order of the agents share a memo key.
+  """
+  valves: tuple[Valve, ...]
+  minutes: tuple[int, ...]
+  # Minutes until the pressure stops counting.
+  horizon: int
+  # Pressure released through the horizon, by the valves opened so far.
   total_pressure_released: int = 0
-  minute: int = 0
-  open_valves: set[str] = field(default_factory=set)
+  # Bits of the open valves.
+  open_valves: int = 0
+  # Total rate of the valves still closed, kept up by open_valve.
+  closed_rate: int = 0
+
+  def move_first(self, valve: Valve, minute: int) -> "State":
+    """Returns a copy with the first agent at `valve` as of `minute`."""
+    valves = list(self.valves[1:])
+    minutes = list(self.minutes[1:])
+    agent_i = 0
+    while agent_i < len(minutes) and (minutes[agent_i], valves[agent_i].index) < (minute, valve.index):
+      agent_i += 1
+    valves.insert(agent_i, valve)
+    minutes.insert(agent_i, minute)
+    return State(
+      valves=tuple(valves),
+      minutes=tuple(minutes),
+      horizon=self.horizon,
+      total_pressure_released=self.total_pressure_released,
+      open_valves=self.open_valves,
+      closed_rate=self.closed_rate,
+    )
+
+  def open_valve(self, valve: Valve, minute: int) -> None:
+    """Opens the valve, finishing at `minute`."""
+    self.total_pressure_released += (self.horizon - minute) * valve.rate
+    self.open_valves |= valve.bit
+    self.closed_rate -= valve.rate
+
+  def rate_bound(self, best_valves: list[Valve]) -> int:
+    """
+    Returns a quick upper bound on the best possible score: every closed
+    valve opened by whoever has the most time left, two minutes from now.
+    O(1), from the closed rate open_valve keeps up.
+    """
+    minutes_remaining = self.horizon - self.minutes[0]
+    return self.total_pressure_released + self.closed_rate * max(minutes_remaining - 2, 0)
 
   def max_score(self, best_valves: list[Valve]) -> int:
     """
@@ -27,119 +116,199 @@ class State:
     with the given best valves (in order).
     """
     best_score = self.total_pressure_released
-    minutes_remaining = 30 - self.minute
+    minutes_remaining = [self.horizon - minute for minute in self.minutes]
     # Assume it takes two minutes to open every valve (one to move, one to
-    # open). This will be slightly wrong if we haven't opened the current valve.
-    index = 0
-    while minutes_remaining > 0 and index < len(best_valves):
-      valve_to_check = best_valves[index]
-      index += 1
-      if valve_to_check.name not in self.open_valves:
-        # A valve we can open!
-        minutes_remaining -= 1
-        if minutes_remaining > 0:
-          best_score += minutes_remaining * valve_to_check.rate
-        # Move to next room.
-        minutes_remaining -= 1
+    # open), and hand each one to whoever has the most time left.
+    for valve_to_check in best_valves:
+      if self.open_valves & valve_to_check.bit:
+        continue
+      agent_i = 0
+      for other_i in range(1, len(minutes_remaining)):
+        if minutes_remaining[other_i] > minutes_remaining[agent_i]:
+          agent_i = other_i
+      minutes_remaining[agent_i] -= 2
+      if minutes_remaining[agent_i] <= 0:
+        break
+      best_score += minutes_remaining[agent_i] * valve_to_check.rate
 
     return best_score
 
-  def clone(self):
-    return State(
-      current_valve=self.current_valve,
-      total_pressure_released=self.total_pressure_released,
-      minute=self.minute,
-      open_valves=set(self.open_valves),
-      elephant_valve=self.elephant_valve,
-    )
-
+  def distance_bound(self, best_valves: list[Valve]) -> int:
+    """
+    Returns an upper bound on the best possible score: every closed valve
+    opened as soon as the nearest agent could walk straight to it. Moving
+    one agent changes its arrival at every valve, so this is recomputed in
+    full for each state.
+    """
+    best_score = self.total_pressure_released
+    agents = list(zip(self.valves, self.minutes))
+    for valve_to_check in best_valves:
+      if self.open_valves & valve_to_check.bit:
+        continue
+      minute = min(
+        agent_minute + agent_valve.distance_to[valve_to_check.index] + 1
+        for agent_valve, agent_minute in agents
+      )
+      if minute < self.horizon:
+        best_score += (self.horizon - minute) * valve_to_check.rate
 
-def main():
-  valve_pattern = re.compile(r"^Valve (\w+) has flow rate=(\d+); tunnels? leads? to valves? ([^\n]*)$")
-  valves_by_name: dict[str, Valve] = {}
-  links_by_name: dict[str, list[str]] = {}
-  with open("input.txt", "r") as infile:
-    for line in infile:
-      match = valve_pattern.search(line)
-      assert match is not None, f"bad line {line}"
-      name = match.group(1)
-      rate = int(match.group(2))
-      valves_by_name[name] = Valve(name=name, rate=rate)
-      links = match.group(3).split(", ")
-      links_by_name[name] = list(links)
+    return best_score
 
-  for name, links in links_by_name.items():
-    valve = valves_by_name[name]
-    for target in links:
-      valve.links.append(valves_by_name[target])
+  def key(self) -> int:
+    """
+    Packs where each agent is, when, and the open valves into an int for the
+    visited map.
+    """
+    key = self.open_valves
+    for valve, minute in zip(self.valves, self.minutes):
+      key = key << 16 | valve.index << 8 | minute
+    return key
 
-  starting_valve = valves_by_name["AA"]
-  best_valves = sorted(
-    (valve for valve in valves_by_name.values() if valve.rate != 0),
-    reverse=True,
-    key=lambda v: v.rate
-  )
 
-  # Explore valves by best-rate-first.
-  for valve in valves_by_name.values():
-    valve.links = sorted(valve.links, reverse=True, key=lambda v: v.rate)
+# Upper bounds on a state's score, cheapest first: rate is O(1), the others
+# walk the closed valves.
+BOUNDS: dict[str, Callable[[State, list[Valve]], int]] = {
+  "rate": State.rate_bound,
+  "two-minute": State.max_score,
+  "distance": State.distance_bound,
+}
 
-  best_score = 0
-  frontier = [State(current_valve=starting_valve)]
 
-  # Visited map. Maps room + valves open to max score. Don't explore a room if
-  # you've been here on a better path before.
-  visited: dict[str, int] = {}
-  
-  # Do a DFS.
+@dataclass
+class SearchStats:
+  states: int = 0
+  seconds: float = 0.0
+  visited_keys: int = 0
+  visited_bytes: int = 0
+  # States each bound was checked against, and how many it pruned, by name.
+  bound_checks: dict[str, int] = field(default_factory=dict)
+  bound_prunes: dict[str, int] = field(default_factory=dict)
+
+  def report(self, label: str) -> None:
+    rate = self.states / self.seconds if self.seconds > 0 else 0
+    print(
+      f"{label}: {self.states} states in {self.seconds:.2f}s ({rate:.0f}/s); "
+      f"visited {self.visited_keys} keys, {self.visited_bytes / 1e6:.1f} MB"
+    )
+    for name, checks in self.bound_checks.items():
+      prunes = self.bound_prunes.get(name, 0)
+      print(f"  {name} bound: pruned {prunes} of {checks} checked ({prunes / checks:.1%})")
+
+
+def is_pruned(
+  state: State, best_valves: list[Valve], best_score: int, bounds: list[str], stats: SearchStats
+) -> bool:
+  """
+  Returns whether any of the bounds shows the state can't beat best_score,
+  trying them in order and counting which one pruned it.
+  """
+  for name in bounds:
+    stats.bound_checks[name] = stats.bound_checks.get(name, 0) + 1
+    if BOUNDS[name](state, best_valves) < best_score:
+      stats.bound_prunes[name] = stats.bound_prunes.get(name, 0) + 1
+      return True
+  return False
+
+
+def visited_size(visited: dict[int, int]) -> int:
+  """Returns the bytes held by the visited map and its keys."""
+  return sys.getsizeof(visited) + sum(sys.getsizeof(key) for key in visited)
+
+
+def search(
+  starting_valve: Valve,
+  best_valves: list[Valve],
+  agents: int,
+  horizon: int,
+  bounds: list[str],
+  stats: SearchStats,
+  best_score: int = 0,
+) -> int:
+  """
+  Returns the most pressure `agents` agents starting together can release in
+  `horizon` minutes. best_score is a score known to be reachable, to prune
+  with from the start.
+  """
+  start = time.perf_counter()
+  frontier = [State(
+    valves=(starting_valve,) * agents,
+    minutes=(0,) * agents,
+    horizon=horizon,
+    closed_rate=sum(valve.rate for valve in best_valves),
+  )]
+
+  # Visited map. Maps rooms + minutes + valves open to the most pressure
+  # released getting there. Don't explore a state you've reached on a better
+  # path before.
+  visited: dict[int, int] = {}
+
+  # Do a DFS. Whoever finished opening their last valve first moves next.
   count = 0
   while len(frontier) > 0:
     count += 1
     curr_state = frontier.pop()
 
-    if curr_state.minute > 30:
-      assert False, "should not happen"
-    elif curr_state.minute == 30:
-      if curr_state.total_pressure_released > best_score:
-        best_score = curr_state.total_pressure_released
-      continue
-
-    max_score = curr_state.max_score(best_valves)
+    if curr_state.total_pressure_released > best_score:
+      best_score = curr_state.total_pressure_released
 
-    if max_score < best_score:
+    if is_pruned(curr_state, best_valves, best_score, bounds, stats):
       # Skip. This is not worth exploring.
       continue
 
-    curr_valve = curr_state.current_valve
-
-    key = f"curr={curr_valve.name};visited={sorted(curr_state.open_valves)}"
-    if key in visited and visited[key] >= max_score:
+    key = curr_state.key()
+    if key in visited and visited[key] >= curr_state.total_pressure_released:
       # Skip. This is not worth exploring.
       continue
 
-    visited[key] = max_score
+    visited[key] = curr_state.total_pressure_released
 
-    if curr_valve.rate != 0 and curr_state.current_valve.name not in curr_state.open_valves:
-      # Turn on valve in room.
-      next_state = curr_state.clone()
-      next_state.minute += 1
-      next_state.total_pressure_released += (30 - next_state.minute) * curr_valve.rate
-      next_state.open_valves.add(curr_valve.name)
-      frontier.append(next_state)
+    curr_valve, curr_minute = curr_state.valves[0], curr_state.minutes[0]
+    if curr_minute >= horizon:
+      # Everyone's done.
+      continue
 
-    for valve in curr_valve.links:
-      # Go to the room, but only actually explore if the 
-      next_state = curr_state.clone()
-      next_state.minute += 1
-      next_state.current_valve = valve
+    if agents > 1:
+      # Stop here, and leave the rest to the others.
+      frontier.append(curr_state.move_first(curr_valve, horizon))
+
+    # Walk to each closed valve and open it. Worst rate is pushed first, so
+    # the best is explored first.
+    for valve, distance in reversed(curr_valve.targets):
+      minute = curr_minute + distance + 1
+      if curr_state.open_valves & valve.bit or minute >= horizon:
+        continue
+      next_state = curr_state.move_first(valve, minute)
+      next_state.open_valve(valve, minute)
       frontier.append(next_state)
 
-  p1_score = best_score
-
-  # ELEPHANT.
-  frontier = [State(current_valve=starting_valve, elephant_valve=starting_valve, minute=4)]
-  best_score = 0
-  visited = {}
+  stats.states += count
+  stats.seconds += time.perf_counter() - start
+  stats.visited_keys += len(visited)
+  stats.visited_bytes += visited_size(visited)
+  return best_score
+
+
+def best_per_subset(starting_valve: Valve, horizon: int, stats: SearchStats) -> list[dict[int, int]]:
+  """
+  Returns the most pressure one agent can release for every set of valves
+  (as bits) it can open, for every time limit up to `horizon`, indexed by
+  time limit.
+
+  A plan that opens its valves with total rate R, by minute m, releases
+  h * R - W by any time limit h >= m, where W sums each valve's rate times
+  the minute it opened. So one pass recording the least W for every set and
+  finishing minute covers every time limit.
+  """
+  start = time.perf_counter()
+  all_rate = sum(valve.rate for valve, _ in starting_valve.targets)
+  # Least W, by set of valves << 8 | finishing minute, and each set's rate.
+  least_weight: dict[int, int] = {}
+  open_rates: dict[int, int] = {}
+  frontier = [State(valves=(starting_valve,), minutes=(0,), horizon=horizon, closed_rate=all_rate)]
+  # No bound to prune with, since every set needs its best, but a state
+  # reached on a better path is still not worth exploring. Plans reaching the
+  # same state open the same valves, so that holds for every time limit.
+  visited: dict[int, int] = {}
 
   # Do a DFS.
   count = 0
@@ -147,61 +316,244 @@ def main():
     count += 1
     curr_state = frontier.pop()
 
-    if curr_state.minute > 30:
-      assert False, "should not happen"
-    elif curr_state.minute == 30:
-      if curr_state.total_pressure_released > best_score:
-        best_score = curr_state.total_pressure_released
-      continue
-
-    max_score = curr_state.max_score(best_valves)
+    open_rate = all_rate - curr_state.closed_rate
+    weight = horizon * open_rate - curr_state.total_pressure_released
+    weight_key = curr_state.open_valves << 8 | curr_state.minutes[0]
+    if least_weight.get(weight_key, weight + 1) > weight:
+      least_weight[weight_key] = weight
+      open_rates[curr_state.open_valves] = open_rate
 
-    if max_score < best_score:
+    key = curr_state.key()
+    if key in visited and visited[key] >= curr_state.total_pressure_released:
       # Skip. This is not worth exploring.
       continue
 
-    curr_valve = curr_state.current_valve
+    visited[key] = curr_state.total_pressure_released
 
-    key = f"curr={curr_valve.name};elephant={curr_state.elephant_valve.name};curr_visited={sorted(curr_state.open_valves)}"
-    if key in visited and visited[key] >= max_score:
-      # Skip. This is not worth exploring.
-      continue
+    for valve, distance in reversed(curr_state.valves[0].targets):
+      minute = curr_state.minutes[0] + distance + 1
+      if curr_state.open_valves & valve.bit or minute >= horizon:
+        continue
+      next_state = curr_state.move_first(valve, minute)
+      next_state.open_valve(valve, minute)
+      frontier.append(next_state)
+
+  # Sorted keys go by set, then finishing minute.
+  best_by_horizon: list[dict[int, int]] = [{} for _ in range(horizon + 1)]
+  weight_keys = sorted(least_weight)
+  for key_i, weight_key in enumerate(weight_keys):
+    valves, minute = weight_key >> 8, weight_key & 0xff
+    if minute == 0 or weight_keys[key_i - 1] >> 8 != valves:
+      weight = least_weight[weight_key]
+    else:
+      weight = min(weight, least_weight[weight_key])
+    if key_i + 1 < len(weight_keys) and weight_keys[key_i + 1] >> 8 == valves:
+      until = weight_keys[key_i + 1] & 0xff
+    else:
+      until = horizon + 1
+    for limit in range(minute, until):
+      best_by_horizon[limit][valves] = limit * open_rates[valves] - weight
+
+  stats.states += count
+  stats.seconds += time.perf_counter() - start
+  stats.visited_keys += len(visited)
+  stats.visited_bytes += visited_size(visited)
+  return best_by_horizon
+
+
+def subset_maxima(best: dict[int, int], valve_count: int) -> list[int]:
+  """
+  Returns, for every set of valves, the best score from opening only valves
+  in that set.
+  """
+  within = [0] * (1 << valve_count)
+  for valves, score in best.items():
+    within[valves] = score
+  for bit_i in range(valve_count):
+    bit = 1 << bit_i
+    for valves in range(len(within)):
+      if valves & bit and within[valves ^ bit] > within[valves]:
+        within[valves] = within[valves ^ bit]
+  return within
+
+
+def combine_agents(best: dict[int, int], valve_count: int, agents: int) -> int:
+  """
+  Returns the most pressure `agents` agents can release together, given the
+  best one agent can do for every set of valves. Agents never share a valve,
+  so it's the best split of the valves into disjoint sets.
+  """
+  all_valves = (1 << valve_count) - 1
+  one_agent = subset_maxima(best, valve_count)
+  within = one_agent
+  for _ in range(agents - 2):
+    # Best for one more agent, within every set: split each set every way.
+    combined = list(within)
+    for valves in range(all_valves + 1):
+      mine = valves
+      while mine > 0:
+        score = one_agent[mine] + within[valves ^ mine]
+        if score > combined[valves]:
+          combined[valves] = score
+        mine = (mine - 1) & valves
+    within = combined
+  if agents == 1:
+    return within[all_valves]
+  # The last agent only needs the best split of every valve.
+  return max(score + within[all_valves ^ valves] for valves, score in best.items())
+
+
+def pick_solver(starting_valve: Valve, best_valves: list[Valve], horizon: int) -> str:
+  """
+  Picks subsets, unless one agent might have time to open every valve. Then
+  nearly every set is reachable in nearly every order, the subset pass has
+  nothing to prune with, and searching the agents together does better.
+  """
+  shortest = min(
+    (distance for valve in [starting_valve] + best_valves for _, distance in valve.targets), default=0
+  )
+  # Every valve takes at least the shortest walk and a minute to open.
+  most_opened = horizon // (shortest + 1)
+  return "subsets" if most_opened < len(best_valves) else "search"
+
+
+def best_for_agents(
+  starting_valve: Valve,
+  best_valves: list[Valve],
+  agents: int,
+  horizon: int,
+  solver: str,
+  bounds: list[str],
+  stats: SearchStats,
+) -> int:
+  """
+  Returns the most pressure `agents` agents can release together in
+  `horizon` minutes, either by combining the best single-agent score for
+  every set of valves, or by searching all the agents together.
+  """
+  if solver == "subsets":
+    best_by_horizon = best_per_subset(starting_valve, horizon, stats)
+    return combine_agents(best_by_horizon[horizon], len(best_valves), agents)
+  return search(starting_valve, best_valves, agents, horizon, bounds, stats)
+
+
+def scores_by_horizon(
+  starting_valve: Valve,
+  best_valves: list[Valve],
+  agents: int,
+  horizon: int,
+  solver: str,
+  bounds: list[str],
+  stats: SearchStats,
+) -> list[int]:
+  """
+  Like `best_for_agents`, for every time limit up to `horizon`, indexed by
+  time limit.
+
+  The subset pass covers every time limit at once. The search's bounds only
+  hold for one time limit, so it runs once per limit, pruning with the last
+  limit's answer since any plan still works with more time.
+  """
+  if solver == "subsets":
+    best_by_horizon = best_per_subset(starting_valve, horizon, stats)
+    return [combine_agents(best, len(best_valves), agents) for best in best_by_horizon]
+  scores = [0]
+  for limit in range(1, horizon + 1):
+    scores.append(search(starting_valve, best_valves, agents, limit, bounds, stats, scores[-1]))
+  return scores
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    "--stats",
+    action="store_true",
+    help="report states expanded per second and the size of the visited map",
+  )
+  parser.add_argument(
+    "--bound",
+    action="append",
+    choices=tuple(BOUNDS),
+    help=(
+      "upper bound to prune the searches with, tried in the order given (default: all, cheapest "
+      "first); rate is O(1) per state, two-minute and distance are O(valves)"
+    ),
+  )
+  parser.add_argument(
+    "--elephant",
+    choices=("auto", "subsets", "search"),
+    default="auto",
+    help=(
+      "combine the best single-agent score for every set of valves, or search the agents together "
+      "(better for long time limits, where every set is reachable); auto picks search when one "
+      "agent might have time to open every valve"
+    ),
+  )
+  parser.add_argument("--agents", type=int, default=2, help="agents sharing the valves for P2")
+  parser.add_argument("--minutes", type=int, default=26, help="time limit for P2")
+  parser.add_argument(
+    "--every-horizon",
+    action="store_true",
+    help=(
+      "report the best P2 score for every time limit up to --minutes; one pass with subsets, but "
+      "search runs once per time limit"
+    ),
+  )
+  args = parser.parse_args()
+  if args.agents < 1:
+    parser.error("--agents must be at least 1")
+  if not 0 < args.minutes < 256:
+    parser.error("state keys pack minutes into a byte, so --minutes must be in [1, 255]")
+
+  valve_pattern = re.compile(r"^Valve (\w+) has flow rate=(\d+); tunnels? leads? to valves? ([^\n]*)$")
+  valves_by_name: dict[str, Valve] = {}
+  links_by_name: dict[str, list[str]] = {}
+  with open("input.txt", "r") as infile:
+    for line in infile:
+      match = valve_pattern.search(line)
+      assert match is not None, f"bad line {line}"
+      name = match.group(1)
+      rate = int(match.group(2))
+      valves_by_name[name] = Valve(name=name, rate=rate)
+      links = match.group(3).split(", ")
+      links_by_name[name] = list(links)
+
+  for name, links in links_by_name.items():
+    valve = valves_by_name[name]
+    for target in links:
+      valve.links.append(valves_by_name[target])
 
-    visited[key] = max_score
-
-    # Search self.
-    my_next_states = []
-    if curr_valve.rate != 0 and curr_valve.name not in curr_state.open_valves:
-      # Turn on valve in room.
-      next_state = curr_state.clone()
-      next_state.minute += 1
-      next_state.total_pressure_released += (30 - next_state.minute) * curr_valve.rate
-      next_state.open_valves.add(curr_valve.name)
-      my_next_states.append(next_state)
-
-    for valve in curr_valve.links:
-      # Go to the room.
-      next_state = curr_state.clone()
-      next_state.minute += 1
-      next_state.current_valve = valve
-      my_next_states.append(next_state)
-
-    # Search elephant.
-    for my_next_state in my_next_states:
-      curr_valve = my_next_state.elephant_valve
-      if curr_valve.rate != 0 and curr_valve.name not in my_next_state.open_valves:
-        # Turn on valve in room.
-        next_state = my_next_state.clone()
-        next_state.total_pressure_released += (30 - my_next_state.minute) * curr_valve.rate
-        next_state.open_valves.add(curr_valve.name)
-        frontier.append(next_state)
-
-      for valve in curr_valve.links:
-        # Go to the room.
-        next_state = my_next_state.clone()
-        next_state.elephant_valve = valve
-        frontier.append(next_state)
-    
+  starting_valve = valves_by_name["AA"]
+  assert starting_valve.rate == 0, "searches assume the starting valve isn't worth opening"
+  best_valves = sorted(
+    (valve for valve in valves_by_name.values() if valve.rate != 0),
+    reverse=True,
+    key=lambda v: v.rate
+  )
+  assert len(best_valves) < 256, "state keys pack valve indices into a byte"
+  compress_valves(starting_valve, best_valves)
+
+  p1_stats = SearchStats()
+  bounds = args.bound or list(BOUNDS)
+  p1_score = search(starting_valve, best_valves, 1, 30, bounds, p1_stats)
+  p2_stats = SearchStats()
+  solver = args.elephant
+  if solver == "auto":
+    solver = pick_solver(starting_valve, best_valves, args.minutes)
+  if args.every_horizon:
+    scores = scores_by_horizon(
+      starting_valve, best_valves, args.agents, args.minutes, solver, bounds, p2_stats
+    )
+    for horizon in range(1, args.minutes + 1):
+      print(f"{horizon} minutes, {args.agents} agents: {scores[horizon]}")
+    best_score = scores[-1]
+  else:
+    best_score = best_for_agents(
+      starting_valve, best_valves, args.agents, args.minutes, solver, bounds, p2_stats
+    )
+  if args.stats:
+    p1_stats.report("P1")
+    p2_stats.report("P2")
 
   print(f"P1 = {p1_score}. P2 = {best_score}.")
 
@@ -1,7 +1,32 @@
 #!/usr/bin/env python3
 
-import re
+import argparse
+from array import array
+from itertools import repeat
+import mmap
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import tracemalloc
 from dataclasses import dataclass, field
+from typing import BinaryIO, Iterable, Iterator
+
+# Unit step for each direction.
+DIRECTIONS = {
+  'U': (0, -1),
+  'D': (0, 1),
+  'L': (-1, 0),
+  'R': (1, 0),
+}
+
+# A run of identical steps, as (dx, dy, count).
+Run = tuple[int, int, int]
+# A segment of visited cells, as (start_x, start_y, dx, dy, count). The start
+# cell itself is not part of the segment.
+Segment = tuple[int, int, int, int, int]
 
 @dataclass
 class Pos:
@@ -12,8 +37,14 @@ class Pos:
 
 @dataclass
 class BigPos:
-  xs: list[int] = field(default_factory=list)
-  ys: list[int] = field(default_factory=list)
+  # Knot coordinates, head first.
+  xs: array = field(default_factory=lambda: array("q"))
+  ys: array = field(default_factory=lambda: array("q"))
+
+  @classmethod
+  def with_knots(cls, knots: int) -> "BigPos":
+    assert knots >= 2, f"need at least a head and a tail, got {knots}"
+    return cls(xs=array("q", bytes(8 * knots)), ys=array("q", bytes(8 * knots)))
 
   def move(self, direction: str):
     # Move head.
@@ -28,44 +59,46 @@ class BigPos:
     else:
       assert False, f"bad: {direction}"
 
-    # Reconcile the rest.
-    for i in range(0, 9):
-      self.reconcile(i, i + 1)
+    self.reconcile_all()
 
-  def reconcile(self, head_i, tail_i):
-    # Move tail, if needed.
-    if abs(self.xs[head_i] - self.xs[tail_i]) > 1 or abs(self.ys[head_i] - self.ys[tail_i]) > 1:
-      # Need to move.
+  def reconcile_all(self):
+    """
+    Reconciles every knot against the one ahead of it in a single pass,
+    stopping at the first knot that doesn't move.
+    """
+    xs, ys = self.xs, self.ys
+    head_x, head_y = xs[0], ys[0]
+    for i in range(1, len(xs)):
+      x, y = xs[i], ys[i]
+      dx = head_x - x
+      dy = head_y - y
+      if -1 <= dx <= 1 and -1 <= dy <= 1:
+        return
+      head_x = xs[i] = x + (dx > 0) - (dx < 0)
+      head_y = ys[i] = y + (dy > 0) - (dy < 0)
+
+  def move_batch_all(self, direction: str, count: int) -> list[list[Segment]]:
+    """
+    Moves the head `count` steps in one go, returning the movement of every
+    knot behind the head as lists of segments (the first entry is knot 1).
+    Knots past the first one that stayed put are left off.
+    """
+    dx, dy = DIRECTIONS[direction]
+    runs: list[Run] = [(dx, dy, count)]
+    self.xs[0] += dx * count
+    self.ys[0] += dy * count
+    knot_segments = []
+    for i in range(1, len(self.xs)):
+      start_x, start_y = self.xs[i], self.ys[i]
+      self.xs[i], self.ys[i], runs = follow_runs(
+        self.xs[i - 1], self.ys[i - 1], start_x, start_y, runs
+      )
+      if not runs:
+        # This knot didn't move, so nothing behind it will either.
+        break
+      knot_segments.append(runs_to_segments(start_x, start_y, runs))
+    return knot_segments
 
-      # Vertical.
-      if self.xs[head_i] == self.xs[tail_i]:
-        if self.ys[head_i] > self.ys[tail_i]:
-          self.ys[tail_i] += 1
-        else:
-          assert self.ys[head_i] < self.ys[tail_i]
-          self.ys[tail_i] -= 1
-      # Horizontal.
-      elif self.ys[head_i] == self.ys[tail_i]:
-        if self.xs[head_i] > self.xs[tail_i]:
-          self.xs[tail_i] += 1
-        else:
-          assert self.xs[head_i] < self.xs[tail_i]
-          self.xs[tail_i] -= 1
-      else:
-        # Diagonal.
-        if self.xs[head_i] > self.xs[tail_i]:
-          assert self.xs[head_i] > self.xs[tail_i]
-          self.xs[tail_i] += 1
-        else:
-          assert self.xs[head_i] < self.xs[tail_i]
-          self.xs[tail_i] -= 1
-        if self.ys[head_i] > self.ys[tail_i]:
-          assert self.ys[head_i] > self.ys[tail_i]
-          self.ys[tail_i] += 1
-        else:
-          assert self.ys[head_i] < self.ys[tail_i]
-          self.ys[tail_i] -= 1
-    
 
 def move(direction: str, pos: Pos):
   # Move head.
@@ -114,31 +147,387 @@ def move(direction: str, pos: Pos):
         pos.tail_y -= 1
 
 
+def sign(val: int) -> int:
+  return (val > 0) - (val < 0)
+
+
+def follow_runs(
+  leader_x: int, leader_y: int, x: int, y: int, runs: list[Run]
+) -> tuple[int, int, list[Run]]:
+  """
+  Moves a knot at (x, y) behind a leader that took the given runs of steps and
+  ended at (leader_x, leader_y). Returns the knot's final position and its own
+  runs of steps.
+
+  Once the knot takes the same step as its leader, the gap between them stops
+  changing, so the rest of the run is taken in one go.
+  """
+  # Rewind the leader to where it started.
+  for dx, dy, count in runs:
+    leader_x -= dx * count
+    leader_y -= dy * count
+
+  out_runs: list[Run] = []
+  for dx, dy, count in runs:
+    while count > 0:
+      leader_x += dx
+      leader_y += dy
+      count -= 1
+      if abs(leader_x - x) <= 1 and abs(leader_y - y) <= 1:
+        continue
+      step_x = sign(leader_x - x)
+      step_y = sign(leader_y - y)
+      steps = 1
+      if step_x == dx and step_y == dy:
+        # In lockstep; follow for the rest of the run.
+        steps += count
+        leader_x += dx * count
+        leader_y += dy * count
+        count = 0
+      x += step_x * steps
+      y += step_y * steps
+      if out_runs and out_runs[-1][0] == step_x and out_runs[-1][1] == step_y:
+        out_runs[-1] = (step_x, step_y, out_runs[-1][2] + steps)
+      else:
+        out_runs.append((step_x, step_y, steps))
+
+  return x, y, out_runs
+
+
+def runs_to_segments(x: int, y: int, runs: list[Run]) -> list[Segment]:
+  segments = []
+  for dx, dy, count in runs:
+    segments.append((x, y, dx, dy, count))
+    x += dx * count
+    y += dy * count
+  return segments
+
+
+def move_batch(direction: str, count: int, pos: Pos) -> list[Segment]:
+  """
+  Moves the head `count` steps in one go, returning the tail's movement as a
+  list of segments.
+  """
+  dx, dy = DIRECTIONS[direction]
+  pos.head_x += dx * count
+  pos.head_y += dy * count
+  start_x, start_y = pos.tail_x, pos.tail_y
+  pos.tail_x, pos.tail_y, runs = follow_runs(
+    pos.head_x, pos.head_y, start_x, start_y, [(dx, dy, count)]
+  )
+  return runs_to_segments(start_x, start_y, runs)
+
+
+class TupleSetStore:
+  """Visited cells as a set of (x, y) tuples."""
+
+  def __init__(self):
+    self.cells: set[tuple[int, int]] = set()
+
+  def add(self, x: int, y: int) -> None:
+    self.cells.add((x, y))
+
+  def add_segment(self, segment: Segment) -> None:
+    x, y, dx, dy, count = segment
+    self.cells.update(zip(
+      range(x + dx, x + dx * (count + 1), dx) if dx else repeat(x, count),
+      range(y + dy, y + dy * (count + 1), dy) if dy else repeat(y, count),
+    ))
+
+  def __len__(self) -> int:
+    return len(self.cells)
+
+
+# Offset applied to coordinates before packing, so negative values fit.
+PACK_OFFSET = 1 << 31
+
+
+class PackedSetStore:
+  """Visited cells as a set of ints, with x and y packed into 32 bits each."""
+
+  def __init__(self):
+    self.cells: set[int] = set()
+
+  def add(self, x: int, y: int) -> None:
+    self.cells.add(((x + PACK_OFFSET) << 32) | (y + PACK_OFFSET))
+
+  def add_segment(self, segment: Segment) -> None:
+    x, y, dx, dy, count = segment
+    # Packing is linear, so a segment is an arithmetic progression.
+    start = ((x + PACK_OFFSET) << 32) | (y + PACK_OFFSET)
+    step = (dx << 32) + dy
+    self.cells.update(range(start + step, start + step * (count + 1), step))
+
+  def __len__(self) -> int:
+    return len(self.cells)
+
+
+class BitmapStore:
+  """
+  Visited cells as one bit each, in square chunks that are allocated the
+  first time a cell in them is visited.
+  """
+  # Chunks are CHUNK_SIZE cells on a side.
+  CHUNK_BITS = 6
+  CHUNK_SIZE = 1 << CHUNK_BITS
+  CHUNK_MASK = CHUNK_SIZE - 1
+
+  def __init__(self):
+    self.chunks: dict[tuple[int, int], bytearray] = {}
+    self.count = 0
+
+  def add(self, x: int, y: int) -> None:
+    key = (x >> self.CHUNK_BITS, y >> self.CHUNK_BITS)
+    chunk = self.chunks.get(key)
+    if chunk is None:
+      chunk = self.chunks[key] = bytearray(self.CHUNK_SIZE * self.CHUNK_SIZE // 8)
+    index = ((y & self.CHUNK_MASK) << self.CHUNK_BITS) | (x & self.CHUNK_MASK)
+    bit = 1 << (index & 7)
+    if not chunk[index >> 3] & bit:
+      chunk[index >> 3] |= bit
+      self.count += 1
+
+  def add_segment(self, segment: Segment) -> None:
+    x, y, dx, dy, count = segment
+    chunks = self.chunks
+    chunk_bits, chunk_mask = self.CHUNK_BITS, self.CHUNK_MASK
+    chunk_key = None
+    chunk = None
+    added = 0
+    for _ in range(count):
+      x += dx
+      y += dy
+      key = (x >> chunk_bits, y >> chunk_bits)
+      if key != chunk_key:
+        chunk_key = key
+        chunk = chunks.get(key)
+        if chunk is None:
+          chunk = chunks[key] = bytearray(self.CHUNK_SIZE * self.CHUNK_SIZE // 8)
+      index = ((y & chunk_mask) << chunk_bits) | (x & chunk_mask)
+      bit = 1 << (index & 7)
+      if not chunk[index >> 3] & bit:
+        chunk[index >> 3] |= bit
+        added += 1
+    self.count += added
+
+  def __len__(self) -> int:
+    return self.count
+
+
+VISITED_STORES = {
+  "tuple": TupleSetStore,
+  "packed": PackedSetStore,
+  "bitmap": BitmapStore,
+}
+
+
+def random_walk(steps: int, seed: int = 0) -> tuple[array, array]:
+  """
+  Builds a random walk of the given number of steps, as parallel arrays of
+  direction indexes (into "UDLR") and run lengths.
+  """
+  rng = random.Random(seed)
+  directions = array("b")
+  counts = array("l")
+  remaining = steps
+  while remaining > 0:
+    count = min(rng.randint(1, 10), remaining)
+    directions.append(rng.randrange(4))
+    counts.append(count)
+    remaining -= count
+  return directions, counts
+
+
+def walk_segments(directions: array, counts: array):
+  """Yields the segments of a walk built by random_walk."""
+  unit_steps = [DIRECTIONS[direction] for direction in "UDLR"]
+  x = y = 0
+  for direction, count in zip(directions, counts):
+    dx, dy = unit_steps[direction]
+    yield x, y, dx, dy, count
+    x += dx * count
+    y += dy * count
+
+
+def benchmark_stores(steps: int) -> None:
+  """
+  Compares visited stores on a random walk, reporting throughput and the
+  memory held by each once the walk is done.
+  """
+  directions, counts = random_walk(steps)
+  print(f"walk of {steps} steps in {len(counts)} segments")
+  for name, store_class in VISITED_STORES.items():
+    store = store_class()
+    store.add(0, 0)
+    start = time.perf_counter()
+    for segment in walk_segments(directions, counts):
+      store.add_segment(segment)
+    elapsed = time.perf_counter() - start
+    cells = len(store)
+    del store
+
+    # Build it again under tracemalloc, which slows allocation down.
+    tracemalloc.start()
+    store = store_class()
+    store.add(0, 0)
+    for segment in walk_segments(directions, counts):
+      store.add_segment(segment)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+
+    print(
+      f"{name:>6}: {cells} cells, {steps / elapsed / 1e6:.2f}M steps/s, "
+      f"{memory / 2**20:.1f} MiB ({memory / cells:.1f} bytes/cell)"
+    )
+
+
+# Direction names by their byte value.
+DIRECTION_BYTES = {ord(direction): direction for direction in DIRECTIONS}
+
+
+def read_chunks(infile: BinaryIO, chunk_size: int, use_mmap: bool) -> Iterator[bytes]:
+  """
+  Yields the contents of a file in chunks of at most `chunk_size` bytes,
+  either with plain reads (which works for pipes) or from a memory map.
+  """
+  # Empty files can't be mapped, and there's nothing to read anyway.
+  if use_mmap and os.fstat(infile.fileno()).st_size > 0:
+    with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+      for start in range(0, len(mapped), chunk_size):
+        yield mapped[start:start + chunk_size]
+  else:
+    while chunk := infile.read(chunk_size):
+      yield chunk
+
+
+def parse_moves(chunks: Iterable[bytes]) -> Iterator[list[tuple[str, int]]]:
+  """
+  Parses "<direction> <count>" lines out of a stream of byte chunks, yielding
+  one batch of moves per chunk. Lines may be split across chunks.
+  """
+  carry = b""
+  for chunk in chunks:
+    lines = (carry + chunk).split(b"\n")
+    carry = lines.pop()
+    yield [parse_move(line) for line in lines if line.strip()]
+  if carry.strip():
+    yield [parse_move(carry)]
+
+
+def parse_move(line: bytes) -> tuple[str, int]:
+  direction = DIRECTION_BYTES.get(line[0])
+  count = line[2:].strip()
+  assert direction is not None and line[1:2] == b" " and count.isdigit(), f"bad line {line!r}"
+  return direction, int(count)
+
+
+def prefetch(batches: Iterator, depth: int = 4) -> Iterator:
+  """
+  Pulls from an iterator on a background thread, keeping at most `depth`
+  items buffered, so reading and parsing overlap with whatever consumes them.
+  """
+  buffered: queue.Queue = queue.Queue(maxsize=depth)
+  done = object()
+
+  def fill():
+    try:
+      for batch in batches:
+        buffered.put(batch)
+    except BaseException as e:
+      buffered.put(e)
+    buffered.put(done)
+
+  threading.Thread(target=fill, daemon=True).start()
+  while (batch := buffered.get()) is not done:
+    if isinstance(batch, BaseException):
+      raise batch
+    yield batch
+
+
 def main():
-  visited: set[tuple[int, int]] = set()
-  visited.add((0, 0))
-  pos = Pos()
-  big_pos = BigPos(
-    xs=[0 for _ in range(0, 10)],
-    ys=[0 for _ in range(0, 10)],
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    "--per-step", action="store_true", help="simulate one unit step at a time"
+  )
+  parser.add_argument(
+    "--knots", type=int, default=10, help="number of knots in the big rope"
+  )
+  parser.add_argument(
+    "--all-knots",
+    action="store_true",
+    help="report spaces visited by every knot of the big rope",
+  )
+  parser.add_argument(
+    "--store",
+    choices=VISITED_STORES.keys(),
+    default="packed",
+    help="how to store visited spaces",
   )
-  big_visited: set[tuple[int, int]] = set()
-  big_visited.add((0, 0))
-  move_pattern = re.compile(r"^([UDLR]) (\d+)$")
-  with open("input.txt", "r") as infile:
-    for line in infile:
-      match = move_pattern.search(line)
-      assert match is not None, f"bad line {line}"
-      direction, count = match.group(1, 2)
-      count = int(count)
-      for _ in range(count):
-        move(direction, pos)
-        visited.add((pos.tail_x, pos.tail_y))
-        big_pos.move(direction)
-        big_visited.add((big_pos.xs[-1], big_pos.ys[-1]))
+  parser.add_argument(
+    "--input", default="input.txt", help="motion log to read, or - for stdin"
+  )
+  parser.add_argument(
+    "--mmap", action="store_true", help="memory-map the input instead of reading it"
+  )
+  parser.add_argument(
+    "--chunk-size", type=int, default=1 << 20, help="bytes to read at a time"
+  )
+  parser.add_argument(
+    "--bench",
+    type=int,
+    metavar="STEPS",
+    help="benchmark visited stores on a random walk of STEPS steps, then exit",
+  )
+  args = parser.parse_args()
+
+  if args.bench:
+    benchmark_stores(args.bench)
+    return
+
+  store_class = VISITED_STORES[args.store]
+  visited = store_class()
+  visited.add(0, 0)
+  pos = Pos()
+  big_pos = BigPos.with_knots(args.knots)
+  # Visited spaces for each knot of the big rope; the last one is the tail.
+  # Only the tail is tracked unless all knots were asked for.
+  tracked_knots = range(1, args.knots) if args.all_knots else range(args.knots - 1, args.knots)
+  knot_visited = [store_class() for _ in tracked_knots]
+  for knot_store in knot_visited:
+    knot_store.add(0, 0)
+  big_visited = knot_visited[-1]
+  if args.input == "-":
+    assert not args.mmap, "can't memory-map stdin"
+    infile = sys.stdin.buffer
+  else:
+    infile = open(args.input, "rb")
+  with infile:
+    chunks = read_chunks(infile, args.chunk_size, args.mmap)
+    for batch in prefetch(parse_moves(chunks)):
+      for direction, count in batch:
+        if args.per_step:
+          for _ in range(count):
+            move(direction, pos)
+            visited.add(pos.tail_x, pos.tail_y)
+            big_pos.move(direction)
+            for knot_i, knot_store in zip(tracked_knots, knot_visited):
+              knot_store.add(big_pos.xs[knot_i], big_pos.ys[knot_i])
+        else:
+          for segment in move_batch(direction, count, pos):
+            visited.add_segment(segment)
+          knot_segments = big_pos.move_batch_all(direction, count)
+          for knot_i, knot_store in zip(tracked_knots, knot_visited):
+            if knot_i > len(knot_segments):
+              break
+            for segment in knot_segments[knot_i - 1]:
+              knot_store.add_segment(segment)
 
   print(f"tail visited {len(visited)} spaces")
   print(f"big tail visited {len(big_visited)} spaces")
+  if args.all_knots:
+    for knot_i, knot_store in zip(tracked_knots, knot_visited):
+      print(f"knot {knot_i} visited {len(knot_store)} spaces")
 
 
 if __name__ == '__main__':